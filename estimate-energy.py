@@ -0,0 +1,38 @@
+#!/usr/bin/python
+
+from src.estimator import EnergyEstimator, read_profile
+
+import argparse
+import json
+import numpy as np
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Estimate the energy of a binary from a basic block profile')
+
+    parser.add_argument('-e', '--elf', required=True, help='RISC-V ELF binary')
+    parser.add_argument('-t', '--table', required=True, help='Energy table generated by gen-power-table.py')
+    parser.add_argument('-p', '--profile', required=True, help='Profile with one "<hex address> <count>" pair per line')
+    parser.add_argument('-c', '--cache', required=False, help='Cache of basic block energy vectors')
+    parser.add_argument('-v', '--verbose', required=False, action='store_true', help='Show the most expensive basic blocks')
+    args = parser.parse_args()
+
+    with open(args.table, 'r') as f:
+        estimator = EnergyEstimator(json.load(f), args.cache)
+
+    estimator.load_binary(args.elf)
+    estimator.save_cache()
+
+    addresses, counts = read_profile(args.profile)
+    energy, block_counts = estimator.estimate(addresses, counts)
+
+    for mnemonic in estimator.unknown:
+        print ("Warning: %d instructions without energy data (%s)" % (estimator.unknown[mnemonic], mnemonic))
+
+    if (args.verbose):
+        block_energy = block_counts * estimator.vectors.sum(axis=1)
+        print ("%18s %15s %15s" % ("Block", "Count", "Total"))
+        for block in np.argsort(block_energy)[::-1][:10]:
+            print ("%18s %15d %1.14f" % (hex(int(estimator.starts[block])), block_counts[block], block_energy[block]))
+
+    print ("%15s %15s %15s %15s" % ("Leakage", "Internal", "Switching", "Total"))
+    print ("%1.14f %1.14f %1.14f %1.14f" % (energy[0], energy[1], energy[2], energy.sum()))
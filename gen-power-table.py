@@ -4,24 +4,76 @@ import bz2
 import argparse
 import os
 import re
+import sys
 import statistics as st
 import numpy as np
 import json
 
-EXPECTED_END_OF_SIMULATION = "Correct End of Simulation"
+from src.sim_logs import parse_file_name, program_stem, read_cycles
+from src.activity import ActivityReader, is_activity_file
+from src.dedup import ContentStore
+from src.baselines import BaselineIndex
+from src.calibration import Calibrator
+from src.counts import CountIndex
 
 class PowerData(object):
-    def __init__(self, leakage, internal, switching, cycles, valid):
+    def __init__(self, leakage, internal, switching, cycles, valid, instructions = 1):
         self.leakage = leakage
         self.internal = internal
         self.switching = switching
         self.cycles = cycles
         self.valid = valid
+        self.instructions = instructions
+        self.activity = None
+        self.duration = 0
+
+    def to_dict(self):
+        return {
+            "leakage": float(self.leakage),
+            "internal": float(self.internal),
+            "switching": float(self.switching),
+            "cycles": float(self.cycles),
+            "valid": self.valid,
+            "instructions": self.instructions,
+            "activity": self.activity,
+            "duration": self.duration
+        }
+
+    # A run with results on both sides can't be the same run split across
+    # partials, e.g. every node uses the same replica prefixes.
+    def overlaps(self, data):
+        if self.cycles > 0 and data["cycles"] > 0:
+            return True
+        if self.leakage + self.internal + self.switching > 0 and data["leakage"] + data["internal"] + data["switching"] > 0:
+            return True
+        if self.cycles + self.leakage + self.internal + self.switching > 0 and not data["valid"]:
+            return True
+        if not self.valid and data["cycles"] + data["leakage"] + data["internal"] + data["switching"] > 0:
+            return True
+        return False
+
+    # Fields are only set by one of the files of a run, so taking the max
+    # combines partial entries while keeping the merge order independent.
+    def merge(self, data):
+        self.leakage = max(self.leakage, np.float128(data["leakage"]))
+        self.internal = max(self.internal, np.float128(data["internal"]))
+        self.switching = max(self.switching, np.float128(data["switching"]))
+        self.cycles = max(self.cycles, np.float128(data["cycles"]))
+        self.valid = self.valid and data["valid"]
+        self.instructions = max(self.instructions, data["instructions"])
+        self.duration = max(self.duration, data.get("duration", 0))
+
+        if data.get("activity") is not None:
+            if self.activity is None:
+                self.activity = {}
+            for group in data["activity"]:
+                self.activity[group] = max(self.activity.get(group, 0.0), data["activity"][group])
 
 class PowerTable(object):
-    def __init__(self, cpu_freq):
+    def __init__(self, cpu_freq, normalize = False):
         self.power_table = {}
         self.time_per_cycle = np.float128(1.0) / np.float128(cpu_freq)
+        self.normalize = normalize
 
     def find_entry(self, index, instruction):
         if instruction not in self.power_table:
@@ -42,11 +94,53 @@ class PowerTable(object):
         entry = self.find_entry(index, instruction)
         entry.cycles = np.float128(cycles)
 
+    def update_instructions(self, index, instruction, instructions):
+        entry = self.find_entry(index, instruction)
+        entry.instructions = instructions
+
+    def update_activity(self, index, instruction, activity, duration):
+        entry = self.find_entry(index, instruction)
+        entry.activity = activity
+        entry.duration = duration
+
     def invalidate_data(self, index, instruction):
         entry = self.find_entry(index, instruction)
         entry.valid = False
 
-    def get_energy(self, instruction):
+    def to_dict(self, tag = None):
+        table = {}
+
+        for instruction in self.power_table:
+            table[instruction] = {}
+            for index in self.power_table[instruction]:
+                key = index if tag is None else tag + ":" + index
+                table[instruction][key] = self.power_table[instruction][index].to_dict()
+
+        return table
+
+    # Entries that collide with a different run already in the table are
+    # kept as separate samples. Returns the number of collisions.
+    def merge(self, table):
+        collisions = 0
+
+        for instruction in table:
+            for index in table[instruction]:
+                data = table[instruction][index]
+                key = index
+                copy = 1
+
+                while self.find_entry(key, instruction).overlaps(data):
+                    copy += 1
+                    key = "%s~%d" % (index, copy)
+
+                if key != index:
+                    collisions += 1
+
+                self.find_entry(key, instruction).merge(data)
+
+        return collisions
+
+    def __get_samples(self, instruction):
         leakage = []
         internal = []
         switching = []
@@ -57,16 +151,40 @@ class PowerTable(object):
 
             if data.valid:
                 t = data.cycles * self.time_per_cycle
+                if self.normalize:
+                    t /= data.instructions
+
                 leakage.append(data.leakage * t)
                 internal.append(data.internal * t)
                 switching.append(data.switching * t)
                 total.append((data.leakage + data.internal + data.switching) * t)
 
+        return (leakage, internal, switching, total)
+
+    def get_energy(self, instruction):
+        leakage, internal, switching, total = self.__get_samples(instruction)
+
         if len(total) > 0:
             return (st.median(leakage), st.median(internal), st.median(switching), st.median(total))
         else:
             return (0.0, 0.0, 0.0, 0.0)
 
+    def get_variance(self, instruction):
+        total = self.__get_samples(instruction)[3]
+
+        if len(total) > 1:
+            return st.variance(total)
+        else:
+            return 0.0
+
+    def get_instructions(self, instruction):
+        instructions = [data.instructions for data in self.power_table[instruction].values() if data.valid]
+
+        if len(instructions) > 0:
+            return st.median(instructions)
+        else:
+            return 1
+
     def show_report(self):
         print ("%15s %15s %15s %15s %15s" % ("Instruction", "Leakage", "Internal", "Switching", "Total"))
 
@@ -75,84 +193,303 @@ class PowerTable(object):
             # print "%s\t%f\t%f\t%f\t%f\t%f\t%f" % (key, st.median(leakage), st.median(internal), st.median(switching), st.median(total), st.stdev(total), st.variance(total))
             print ("%15s %1.14f %1.14f %1.14f %1.14f" % (instruction, et[0], et[1], et[2], et[3]))
 
-def GenEnergyTable(init_pt, full_pt):
-    print ("%15s %15s %15s %15s %15s" % ("Instruction", "Leakage", "Internal", "Switching", "Total"))
+def GenEnergyTable(init_pt, full_pt, pools = None):
+    print ("%15s %15s %15s %15s %15s %15s" % ("Instruction", "Leakage", "Internal", "Switching", "Total", "Stdev"))
 
     energy_table = {}
+    e = "----------------"
 
     for instruction in full_pt.power_table:
-        init = init_pt.get_energy(instruction)
+        baseline = instruction
+        scale = 1.0
+        if pools is not None and instruction in pools:
+            baseline = pools[instruction]
+            # Shared baselines have no loop body to normalize by
+            if full_pt.normalize:
+                scale = float(full_pt.get_instructions(instruction))
+
+        if baseline not in init_pt.power_table:
+            print ("%15s %15s %15s %15s %15s %15s" % (instruction, e, e, e, e, e))
+            continue
+
+        init = tuple(v / scale for v in init_pt.get_energy(baseline))
         full = full_pt.get_energy(instruction)
 
+        # The subtracted estimates come from independent runs
+        stdev = np.sqrt(float(full_pt.get_variance(instruction)) + float(init_pt.get_variance(baseline)) / scale ** 2)
+
         if (init[3] > 0.0 and full[3] > init[3]):
             leakage = full[0] - init[0]
             internal = full[1] - init[1]
             switching = full[2] - init[2]
 
-            print ("%15s %1.14f %1.14f %1.14f %1.14f" % (instruction,
+            print ("%15s %1.14f %1.14f %1.14f %1.14f %1.14f" % (instruction,
                                                  leakage,
                                                  internal,
                                                  switching,
-                                                 full[3] - init[3]))
+                                                 full[3] - init[3],
+                                                 stdev))
             energy_table[instruction] = []
             energy_table[instruction].append({
                 "leakage": float(leakage),
                 "internal": float(internal),
-                "switching": float(switching)
+                "switching": float(switching),
+                "stdev": float(stdev),
+                "normalized": bool(full_pt.normalize)
             })
         else:
-            e = "----------------"
-            print ("%15s %15s %15s %15s %15s" % (instruction, e, e, e, e))
+            print ("%15s %15s %15s %15s %15s %15s" % (instruction, e, e, e, e, e))
 
     return energy_table
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description = 'Generate power tables')
-    parser.add_argument('-i', '--input', required=True, help='Input directory')
-    parser.add_argument('-o', '--output', required=False, help='Output file')
+# Fits leakage, internal and switching power as a linear function of the
+# toggles per cycle of each signal group, using the runs that have both a
+# switching activity dump and a power report.
+def FitActivityModel(tables):
+    groups = set()
+    for pt in tables:
+        for instruction in pt.power_table:
+            for data in pt.power_table[instruction].values():
+                if data.activity is not None:
+                    groups.update(data.activity)
+
+    groups = sorted(groups)
+    rows = []
+    targets = []
+
+    for pt in tables:
+        for instruction in pt.power_table:
+            for data in pt.power_table[instruction].values():
+                if data.valid and data.activity is not None and data.cycles > 0 and data.leakage + data.internal + data.switching > 0:
+                    rows.append(ActivityVector(data, groups))
+                    targets.append([float(data.leakage), float(data.internal), float(data.switching)])
+
+    if len(rows) <= len(groups):
+        print ("Error: %d runs are not enough to fit %d signal groups" % (len(rows), len(groups)))
+        return None
+
+    return (groups, np.linalg.lstsq(np.array(rows), np.array(targets), rcond=None)[0])
+
+# Toggles are counted over the dump window, so they are normalized by its
+# duration. Dumps share the simulator timescale, which keeps the rates of
+# different runs comparable. Runs without one fall back to their cycles.
+def ActivityVector(data, groups):
+    duration = float(data.duration) if data.duration > 0 else float(data.cycles)
+    return [1.0] + [data.activity.get(group, 0.0) / duration for group in groups]
+
+def EstimatePower(pt, model):
+    groups, coefficients = model
+
+    print ("%15s %15s %15s %15s" % ("Instruction", "Index", "Reported", "Estimated"))
+
+    for instruction in pt.power_table:
+        for index in pt.power_table[instruction]:
+            data = pt.power_table[instruction][index]
+            if not data.valid or data.activity is None or data.cycles <= 0:
+                continue
+
+            estimate = np.dot(ActivityVector(data, groups), coefficients)
+            reported = data.leakage + data.internal + data.switching
+
+            if reported > 0:
+                print ("%15s %15s %1.13f %1.13f" % (instruction, index, reported, sum(estimate)))
+            else:
+                print ("%15s %15s %15s %1.13f" % (instruction, index, "----------------", sum(estimate)))
+                pt.update_power(index, instruction, estimate[0], estimate[1], estimate[2])
+
+def ShowBaselineReport(init_pt, pools):
+    print ("%25s %8s %15s %15s" % ("Pool", "Replicas", "Total", "Stdev"))
+
+    for pool in sorted(set(pools.values())):
+        if pool not in init_pt.power_table:
+            print ("%25s %8d %15s %15s" % (pool, 0, "----------------", "----------------"))
+            continue
 
-    args = parser.parse_args()
-    dir = args.input
+        replicas = len([data for data in init_pt.power_table[pool].values() if data.valid])
+        print ("%25s %8d %1.14f %1.14f" % (pool, replicas, init_pt.get_energy(pool)[3], np.sqrt(init_pt.get_variance(pool))))
 
-    full_pt = PowerTable(40000000.0)
-    init_pt = PowerTable(40000000.0)
+def LoadResult(init_pt, full_pt, file, data, counts = None):
+    name = parse_file_name(file)
 
-    for file in os.listdir(dir):
-        if "init" in file:
-            pt = init_pt
+    if name.init:
+        pt = init_pt
+    else:
+        pt = full_pt
+
+    index = name.index
+    inst_name = name.instruction
+
+    if file.endswith(".error"):
+        if len(data) > 0:
+            print ("Error: %s is not empty" % (file))
+            pt.invalidate_data(index, inst_name)
+
+    elif file.endswith(".log"):
+        cycles = read_cycles(data)
+        if cycles is None:
+            print ("Error: %s invalid simulation result" % (file))
+            pt.invalidate_data(index, inst_name)
         else:
-            pt = full_pt
+            pt.update_cycles(index, inst_name, cycles)
+            if name.iterations is not None and name.nInstructions > 0:
+                executed = name.iterations * name.nInstructions
+                if counts is not None:
+                    executed = counts.get(program_stem(file), executed)
+                pt.update_instructions(index, inst_name, executed)
+    elif file.endswith(".txt"):
+        power_data = data.split("\n")[15].split()
+        pt.update_power(index, inst_name, float(power_data[1]), float(power_data[2]), float(power_data[3]))
+
+# Loop window of a run in dump time units. The prologue lasts as long as
+# the _init run minus its empty loop iterations, and the loop runs until
+# the end of the program.
+def LoopWindow(init_pt, full_pt, file, period, pools = None):
+    name = parse_file_name(file)
+    if name.iterations is None:
+        return None
+
+    baseline = name.instruction
+    if pools is not None and name.instruction in pools:
+        baseline = pools[name.instruction]
+
+    init = init_pt.power_table.get(baseline, {}).get(name.index)
+    run = (init_pt if name.init else full_pt).power_table.get(name.instruction, {}).get(name.index)
+    if init is None or run is None or init.cycles <= 0 or run.cycles <= 0:
+        return None
+
+    prologue = max(init.cycles - name.iterations * Calibrator.LOOP_OVERHEAD, 0)
+    return (int(prologue * period), int(run.cycles * period))
+
+def LoadDirectory(dir, init_pt, full_pt, reader = None, aliases = None, counts = None, period = None, pools = None):
+    dumps = []
 
-        sp_data = file.split("_")
-        if len(sp_data) < 2:
+    for file in os.listdir(dir):
+        name = parse_file_name(file)
+        if name is None:
             continue
 
-        index = sp_data[0]
-        if "not_taken" in file:
-            inst_name = sp_data[3] + "_not_taken"
-        else:
-            inst_name = sp_data[1]
+        # Results of a deduplicated program also belong to its aliases
+        files = [file]
+        stem = program_stem(file)
+        if aliases is not None and stem in aliases:
+            files += [alias + file[len(stem):] for alias in aliases[stem]]
+
+        if is_activity_file(file):
+            if reader is not None:
+                dumps.append((file, files))
+            continue
 
         with open(dir + "/" + file, "r") as f:
             data = f.read();
 
-            if file.endswith(".error"):
-                if len(data) > 0:
-                    print ("Error: %s is not empty" % (file))
-                    pt.invalidate_data(index, inst_name)
+        for alias in files:
+            LoadResult(init_pt, full_pt, alias, data, counts)
+
+    # A global window only fits dumps of a single kernel
+    if reader is not None and period is None and (reader.start is not None or reader.end is not None):
+        if len(set(parse_file_name(file).instruction for file, files in dumps)) > 1:
+            raise ValueError("a start:end window can't be shared by dumps of different kernels, use --window loop")
+
+    # Dumps are read after the logs, so per-run windows can use their cycles
+    for file, files in dumps:
+        start, end = None, None
+        if period is not None:
+            window = LoopWindow(init_pt, full_pt, file, period, pools)
+            if window is None:
+                print ("Error: %s has no simulation cycles to find its loop window" % (file))
+                continue
+            start, end = window
+
+        activity, duration = reader.read(os.path.join(dir, file), start, end)
+        for alias in files:
+            name = parse_file_name(alias)
+            (init_pt if name.init else full_pt).update_activity(name.index, name.instruction, activity, duration)
+
+def SavePartial(file_name, init_pt, full_pt, tag):
+    with open(file_name, 'w') as outfile:
+        json.dump({ "init": init_pt.to_dict(tag), "full": full_pt.to_dict(tag) }, outfile)
+
+def LoadPartial(file_name, init_pt, full_pt):
+    with open(file_name, 'r') as infile:
+        data = json.load(infile)
+
+    collisions = init_pt.merge(data["init"]) + full_pt.merge(data["full"])
+    if collisions > 0:
+        print ("Warning: %d runs of %s reuse replica indexes of other partials and were kept as separate samples, use --tag to name them" % (collisions, file_name))
 
-            elif file.endswith(".log"):
-                if EXPECTED_END_OF_SIMULATION not in data:
-                    print ("Error: %s invalid simulation result" % (file))
-                    pt.invalidate_data(index, inst_name)
-                else:
-                    idx = data.rfind("CLK(") + 4
-                    cycles = int(data[idx:idx+8], 16)
-                    pt.update_cycles(index, inst_name, cycles)
-            elif file.endswith(".txt"):
-                power_data = data.split("\n")[15].split()
-                pt.update_power(index, inst_name, float(power_data[1]), float(power_data[2]), float(power_data[3]))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate power tables')
+    parser.add_argument('-i', '--input', required=False, help='Input directory')
+    parser.add_argument('-o', '--output', required=False, help='Output file')
+    parser.add_argument('-n', '--normalize', required=False, action='store_true', help='Report energy per executed instruction using the program sizes in the filenames')
+    parser.add_argument('-m', '--map', required=False, help='Save a partial aggregate to this file instead of reporting')
+    parser.add_argument('-r', '--reduce', required=False, nargs='+', help='Merge these partial aggregates')
+    parser.add_argument('-t', '--tag', required=False, help='Qualify the replica indexes of the partial aggregate with this tag')
+    parser.add_argument('-a', '--activity', required=False, action='store_true', help='Read VCD/SAIF switching activity dumps')
+    parser.add_argument('-d', '--depth', type=int, default=2, help='Scope depth used to group signals of activity dumps')
+    parser.add_argument('-w', '--window', required=False, help='Count VCD toggles only inside the start:end time window of a single kernel, or inside the loop of each run with "loop"')
+    parser.add_argument('-p', '--period', type=float, required=False, help='Dump time units per clock cycle, required by --window loop')
+    parser.add_argument('-u', '--dedup', required=False, help='content-index.json of deduplicated programs whose results are shared with their aliases')
+    parser.add_argument('-b', '--baselines', required=False, help='baselines.json mapping instructions to pools of shared _init baselines')
+    parser.add_argument('-c', '--counts', required=False, help='dynamic-counts.json with the executed instructions of pre-simulated programs, used by --normalize')
+    parser.add_argument('-e', '--estimate', required=False, action='store_true', help='Estimate the power of runs without a report from their switching activity')
 
+    args = parser.parse_args()
+    if args.input is None and args.reduce is None:
+        parser.error('-i or -r is required')
+
+    full_pt = PowerTable(40000000.0, args.normalize)
+    init_pt = PowerTable(40000000.0, args.normalize)
+
+    reader = None
+    period = None
+    if args.activity:
+        start, end = None, None
+        if args.window == "loop":
+            if args.period is None:
+                parser.error('--window loop requires --period')
+            period = args.period
+        elif args.window is not None:
+            start, end = [int(t) if t else None for t in args.window.split(":")]
+        reader = ActivityReader(args.depth, start, end)
+
+    pools = None
+    if args.baselines is not None:
+        pools = BaselineIndex(args.baselines).pools
+
+    aliases = None
+    if args.dedup is not None:
+        aliases = ContentStore(args.dedup).get_aliases()
+
+    counts = None
+    if args.counts is not None:
+        counts = CountIndex(args.counts).counts
+
+    if args.input is not None:
+        try:
+            LoadDirectory(args.input, init_pt, full_pt, reader, aliases, counts, period, pools)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.reduce is not None:
+        for file_name in args.reduce:
+            LoadPartial(file_name, init_pt, full_pt)
+
+    if args.map is not None:
+        SavePartial(args.map, init_pt, full_pt, args.tag)
+        sys.exit(0)
+
+    if args.estimate:
+        model = FitActivityModel([init_pt, full_pt])
+
+        if model is not None:
+            print ("")
+            print ("######### Full activity #########")
+            EstimatePower(full_pt, model)
+
+            print ("")
+            print ("######### Init activity #########")
+            EstimatePower(init_pt, model)
 
     print ("")
     print ("######### Full result #########")
@@ -162,8 +499,13 @@ if __name__ == '__main__':
     print ("######### Init result #########")
     init_pt.show_report()
 
+    if pools is not None:
+        print ("")
+        print ("######### Baseline pools #########")
+        ShowBaselineReport(init_pt, pools)
+
     print ("")
     print ("######### Energy result #########")
-    data = GenEnergyTable(init_pt, full_pt)
+    data = GenEnergyTable(init_pt, full_pt, pools)
     with open(args.output, 'w') as outfile:
         json.dump(data, outfile)
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+
+from src.calibration import Calibrator
+from src.sharding import ShardPlanner
+from src.baselines import BaselineIndex
+from src.counts import CountIndex
+
+import argparse
+import os
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Split characterization programs into simulation shards of balanced cost')
+
+    parser.add_argument('-n', '--number', type=int, required=True, help='Number of shards')
+    parser.add_argument('-i', '--input', default='test-programs', help='Directory of generated programs, or of binaries built with gen-test-programs.py --pipeline')
+    parser.add_argument('-l', '--logs', required=False, help='Simulation logs of a previous campaign used to estimate costs')
+    parser.add_argument('-b', '--baselines', required=False, help='baselines.json of a shared-baseline campaign, by default the one in the input directory')
+    parser.add_argument('-c', '--counts', required=False, help='dynamic-counts.json of a pre-simulated campaign, by default the one in the input directory')
+    parser.add_argument('-o', '--output', default='shards', help='Output directory for the shard job lists')
+    parser.add_argument('-v', '--verbose', required=False, action='store_true', help='Show debug information')
+    args = parser.parse_args()
+
+    planner = ShardPlanner(Calibrator())
+    if args.logs is not None:
+        planner.load_logs(args.logs,
+                          BaselineIndex(args.baselines or os.path.join(args.input, 'baselines.json')).pools,
+                          CountIndex(args.counts or os.path.join(args.input, 'dynamic-counts.json')).counts)
+
+    programs = [os.path.join(args.input, file) for file in sorted(os.listdir(args.input)) if file.endswith(".s") or file.endswith(".riscv")]
+    shards, loads = planner.plan(programs, args.number)
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    for shard in range(0, args.number):
+        file_name = os.path.join(args.output, 'shard_' + str(shard) + '.txt')
+        open(file_name, 'wt').write("".join(program + "\n" for program in shards[shard]))
+
+        if (args.verbose):
+            print ('%s: %d programs, %d cycles' % (file_name, len(shards[shard]), loads[shard]))
+
+    print ('Estimated makespan: %d cycles (%d cycles / %d shards = %d)' % (max(loads), sum(loads), args.number, sum(loads) // args.number))
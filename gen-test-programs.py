@@ -4,182 +4,317 @@ from src.default_template import *
 from src.basic_templates import *
 from src.jump_templates import *
 from src.load_store_templates import *
+from src.calibration import Calibrator
+from src.presim import PreSimulator, SimulationError
+from src.dedup import ContentStore
+from src.baselines import BaselineIndex
+from src.counts import CountIndex
+from src.pipeline import AssemblerPipeline
 
 import argparse
+import os
 import random
 
+# Class and constructor arguments of each template, so a single template
+# can be rebuilt without instantiating the whole list
+TEMPLATES = [
+    # RV32I
+    (TypeNOP, "nop", Extension.I),
+    (TypeU, "lui", Extension.I),
+    (TypeU, "auipc", Extension.I),
+    (TypeJ, "jal", Extension.I),
+    (TypeJR, "jalr", Extension.I),
+
+    (TypeB, "beq", Extension.I, TypeB.EQUAL_TST),
+    (TypeB, "bne", Extension.I, TypeB.LOWER_TST),
+    (TypeB, "blt", Extension.I, TypeB.LOWER_TST),
+    (TypeB, "bge", Extension.I, TypeB.GRATER_TST),
+    (TypeB, "bltu", Extension.I, TypeB.LOWER_TST),
+    (TypeB, "bgeu", Extension.I, TypeB.GRATER_TST),
+
+    (TypeB, "beq", Extension.I, TypeB.LOWER_TST, "not_taken_"),
+    (TypeB, "bne", Extension.I, TypeB.EQUAL_TST, "not_taken_"),
+    (TypeB, "blt", Extension.I, TypeB.GRATER_TST, "not_taken_"),
+    (TypeB, "bge", Extension.I, TypeB.LOWER_TST, "not_taken_"),
+    (TypeB, "bltu", Extension.I, TypeB.GRATER_TST, "not_taken_"),
+    (TypeB, "bgeu", Extension.I, TypeB.LOWER_TST, "not_taken_"),
+
+    (TypeILS, "lb", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "lh", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "lw", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "lbu", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "lhu", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "sb", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "sh", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "sw", Extension.I, 0x10000000, 0x10080000),
+    (TypeI, "addi", Extension.I),
+    (TypeI, "slti", Extension.I),
+    (TypeI, "sltiu", Extension.I),
+    (TypeI, "xori", Extension.I),
+    (TypeI, "ori", Extension.I),
+    (TypeI, "andi", Extension.I),
+    (TypeRS, "slli", Extension.I),
+    (TypeRS, "srli", Extension.I),
+    (TypeRS, "srai", Extension.I),
+    (TypeR, "add", Extension.I),
+    (TypeR, "sub", Extension.I),
+    (TypeR, "sll", Extension.I),
+    (TypeR, "slt", Extension.I),
+    (TypeR, "sltu", Extension.I),
+    (TypeR, "xor", Extension.I),
+    (TypeR, "srl", Extension.I),
+    (TypeR, "sra", Extension.I),
+    (TypeR, "or", Extension.I),
+    (TypeR, "and", Extension.I),
+
+    # RV64I
+    (TypeILS, "lwu", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "ld", Extension.I, 0x10000000, 0x10080000),
+    (TypeILS, "sd", Extension.I, 0x10000000, 0x10080000),
+    (TypeI, "addiw", Extension.I),
+    (TypeRS, "slliw", Extension.I),
+    (TypeRS, "srliw", Extension.I),
+    (TypeRS, "sraiw", Extension.I),
+    (TypeR, "addw", Extension.I),
+    (TypeR, "subw", Extension.I),
+    (TypeR, "sllw", Extension.I),
+    (TypeR, "srlw", Extension.I),
+    (TypeR, "sraw", Extension.I),
+
+    # RV32M
+    (TypeR, "mul", Extension.I),
+    (TypeR, "mulh", Extension.I),
+    (TypeR, "mulhsu", Extension.I),
+    (TypeR, "mulhu", Extension.I),
+    (TypeRD, "div", Extension.I),
+    (TypeRD, "divu", Extension.I),
+    (TypeRD, "rem", Extension.I),
+    (TypeRD, "remu", Extension.I),
+
+    # RV64M
+    (TypeR, "mulw", Extension.I),
+    (TypeRD, "divw", Extension.I),
+    (TypeRD, "divuw", Extension.I),
+    (TypeRD, "remw", Extension.I),
+    (TypeRD, "remuw", Extension.I),
+
+    # # RV32F
+    # (TypeILSF, "flw", Extension.S, 0x10000000, 0x10080000),
+    # (TypeILSF, "fsw", Extension.S, 0x10000000, 0x10080000),
+    # (TypeR4, "fmadd.s", Extension.S),
+    # (TypeR4, "fmsub.s", Extension.S),
+    # (TypeR4, "fnmsub.s", Extension.S),
+    # (TypeR4, "fnmadd.s", Extension.S),
+    # (TypeR, "fadd.s", Extension.S),
+    # (TypeR, "fsub.s", Extension.S),
+    # (TypeR, "fmul.s", Extension.S),
+    # (TypeR, "fdiv.s", Extension.S),
+    # (TypeR2, "fsqrt.s", Extension.S),
+    # (TypeR, "fsgnj.s", Extension.S),
+    # (TypeR, "fsgnjn.s", Extension.S),
+    # (TypeR, "fsgnjx.s", Extension.S),
+    # (TypeR, "fmin.s", Extension.S),
+    # (TypeR, "fmax.s", Extension.S),
+    # (TypeR2DI, "fcvt.w.s", Extension.S),
+    # (TypeR2DI, "fcvt.wu.s", Extension.S),
+    # (TypeR2DI, "fmv.x.w", Extension.S),
+    # (TypeRF, "feq.s", Extension.S),
+    # (TypeRF, "flt.s", Extension.S),
+    # (TypeRF, "fle.s", Extension.S),
+    # (TypeR2DI, "fclass.s", Extension.S),
+    # (TypeR2DF, "fcvt.s.w", Extension.I),
+    # (TypeR2DF, "fcvt.s.wu", Extension.I),
+    # (TypeR2DF, "fmv.w.x", Extension.I), # TODO: inicializar x com um numero real
+
+    # RV32D
+    (TypeILSF, "fld", Extension.D, 0x10000000, 0x10080000),
+    (TypeILSF, "fsd", Extension.D, 0x10000000, 0x10080000),
+    (TypeR4, "fmadd.d", Extension.D),
+    (TypeR4, "fmsub.d", Extension.D),
+    (TypeR4, "fnmsub.d", Extension.D),
+    (TypeR4, "fnmadd.d", Extension.D),
+    (TypeR, "fadd.d", Extension.D),
+    (TypeR, "fsub.d", Extension.D),
+    (TypeR, "fmul.d", Extension.D),
+    (TypeR, "fdiv.d", Extension.D),
+    (TypeR2, "fsqrt.d", Extension.D),
+    (TypeR, "fsgnj.d" , Extension.D),
+    (TypeR, "fsgnjn.d", Extension.D),
+    (TypeR, "fsgnjx.d", Extension.D),
+    (TypeR, "fmin.d", Extension.D),
+    (TypeR, "fmax.d", Extension.D),
+    (TypeR2, "fcvt.s.d", Extension.D),
+    (TypeR2, "fcvt.d.s", Extension.S),
+    (TypeRF, "feq.d", Extension.D),
+    (TypeRF, "flt.d", Extension.D),
+    (TypeRF, "fle.d", Extension.D),
+    (TypeR2DI, "fclass.d", Extension.D),
+    (TypeR2DI, "fcvt.w.d", Extension.D),
+    (TypeR2DI, "fcvt.wu.d", Extension.D),
+    (TypeR2DF, "fcvt.d.w", Extension.I),
+    (TypeR2DF, "fcvt.d.wu", Extension.I),
+
+    # # RV64F
+    # (TypeR2DI, "fcvt.l.s", Extension.S),
+    # (TypeR2DI, "fcvt.lu.s", Extension.S),
+    # (TypeR2DF, "fcvt.s.l", Extension.I),
+    # (TypeR2DF, "fcvt.s.lu", Extension.I),
+
+    # RV64D
+    (TypeR2DI, "fcvt.l.d", Extension.D),
+    (TypeR2DI, "fcvt.lu.d", Extension.D),
+    (TypeR2DI, "fmv.x.d", Extension.D),
+    (TypeR2DF, "fcvt.d.l", Extension.I),
+    (TypeR2DF, "fcvt.d.lu", Extension.I),
+    (TypeR2DF, "fmv.d.x", Extension.I) # TODO: iniciar x com um valor real
+]
+
+def build_template(position):
+    factory = TEMPLATES[position]
+    return factory[0](*factory[1:])
+
+def build_templates():
+    return [build_template(position) for position in range(0, len(TEMPLATES))]
+
+def setup_template(template, args, store, pipeline):
+    template.reserve_destination_registers(6)
+
+    if (args.output is not None):
+        template.set_dir(args.output)
+    if (args.prefix is not None):
+        template.set_prefix(args.prefix)
+    if (store is not None):
+        template.set_store(store)
+    if (pipeline is not None):
+        template.set_pipeline(pipeline)
+    if (args.table_init):
+        template.set_table_init(True)
+
 if __name__ == '__main__':
     random.seed()
 
     parser = argparse.ArgumentParser(description = 'Generate characterization programs for Instruction Based Power Models')
 
-    parser.add_argument('-i', '--iterations', type=int, required=True, help='Number of loop iterations')
-    parser.add_argument('-n', '--number', type=int, required=True, help='Number of instructions to include in the loop body')
+    parser.add_argument('-i', '--iterations', type=int, required=False, help='Number of loop iterations')
+    parser.add_argument('-n', '--number', type=int, required=False, help='Number of instructions to include in the loop body')
+    parser.add_argument('-c', '--calibrate', required=False, action='store_true', help='Choose iterations and loop body length per instruction')
+    parser.add_argument('-l', '--logs', required=False, help='Simulation logs of a previous campaign used to calibrate')
+    parser.add_argument('-t', '--target-cycles', type=int, default=2048, help='Cycles spent in the loop body of calibrated programs')
+    parser.add_argument('-r', '--ratio', type=float, default=16.0, help='Minimum loop body to loop overhead cycle ratio of calibrated programs')
     parser.add_argument('-o', '--output', required=False, help='Output directory for template programs')
     parser.add_argument('-v', '--verbose', required=False, action='store_true', help='Show debug information')
     parser.add_argument('-p', '--prefix', required=False, help='Add this prefix to all filenames')
+    parser.add_argument('-s', '--presim', required=False, action='store_true', help='Execute each program functionally, regenerate the ones that fail and record their executed instructions in dynamic-counts.json')
+    parser.add_argument('-a', '--attempts', type=int, default=8, help='Number of generation attempts per program with --presim')
+    parser.add_argument('-b', '--shared-baselines', required=False, action='store_true', help='Save one _init baseline per template family and record the pools in baselines.json')
+    parser.add_argument('-x', '--pipeline', required=False, action='store_true', help='Assemble programs from memory into binaries and hex images, using the toolchain in $RISCV')
+    parser.add_argument('-k', '--keep-sources', required=False, action='store_true', help='Also write the .s files with --pipeline')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Number of concurrent assembler jobs with --pipeline')
+    parser.add_argument('-O', '--bin', default='bin', help='Output directory for binaries with --pipeline')
+    parser.add_argument('-u', '--dedup', required=False, action='store_true', help='Save identical programs once and record the others as aliases in content-index.json')
+    parser.add_argument('-T', '--table-init', required=False, action='store_true', help='Load initial register values from a data table instead of lui/addi pairs')
     args = parser.parse_args()
 
-    templates = [
-        # RV32I
-        TypeNOP("nop", Extension.I),
-        TypeU("lui", Extension.I),
-        TypeU("auipc", Extension.I),
-        TypeJ("jal", Extension.I),
-        TypeJR("jalr", Extension.I),
-
-        TypeB("beq", Extension.I, TypeB.EQUAL_TST),
-        TypeB("bne", Extension.I, TypeB.LOWER_TST),
-        TypeB("blt", Extension.I, TypeB.LOWER_TST),
-        TypeB("bge", Extension.I, TypeB.GRATER_TST),
-        TypeB("bltu", Extension.I, TypeB.LOWER_TST),
-        TypeB("bgeu", Extension.I, TypeB.GRATER_TST),
-
-        TypeB("beq", Extension.I, TypeB.LOWER_TST, "not_taken_"),
-        TypeB("bne", Extension.I, TypeB.EQUAL_TST, "not_taken_"),
-        TypeB("blt", Extension.I, TypeB.GRATER_TST, "not_taken_"),
-        TypeB("bge", Extension.I, TypeB.LOWER_TST, "not_taken_"),
-        TypeB("bltu", Extension.I, TypeB.GRATER_TST, "not_taken_"),
-        TypeB("bgeu", Extension.I, TypeB.LOWER_TST, "not_taken_"),
-
-        TypeILS("lb", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("lh", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("lw", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("lbu", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("lhu", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("sb", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("sh", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("sw", Extension.I, 0x10000000, 0x10080000),
-        TypeI("addi", Extension.I),
-        TypeI("slti", Extension.I),
-        TypeI("sltiu", Extension.I),
-        TypeI("xori", Extension.I),
-        TypeI("ori", Extension.I),
-        TypeI("andi", Extension.I),
-        TypeRS("slli", Extension.I),
-        TypeRS("srli", Extension.I),
-        TypeRS("srai", Extension.I),
-        TypeR("add", Extension.I),
-        TypeR("sub", Extension.I),
-        TypeR("sll", Extension.I),
-        TypeR("slt", Extension.I),
-        TypeR("sltu", Extension.I),
-        TypeR("xor", Extension.I),
-        TypeR("srl", Extension.I),
-        TypeR("sra", Extension.I),
-        TypeR("or", Extension.I),
-        TypeR("and", Extension.I),
-
-        # RV64I
-        TypeILS("lwu", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("ld", Extension.I, 0x10000000, 0x10080000),
-        TypeILS("sd", Extension.I, 0x10000000, 0x10080000),
-        TypeI("addiw", Extension.I),
-        TypeRS("slliw", Extension.I),
-        TypeRS("srliw", Extension.I),
-        TypeRS("sraiw", Extension.I),
-        TypeR("addw", Extension.I),
-        TypeR("subw", Extension.I),
-        TypeR("sllw", Extension.I),
-        TypeR("srlw", Extension.I),
-        TypeR("sraw", Extension.I),
-
-        # RV32M
-        TypeR("mul", Extension.I),
-        TypeR("mulh", Extension.I),
-        TypeR("mulhsu", Extension.I),
-        TypeR("mulhu", Extension.I),
-        TypeRD("div", Extension.I),
-        TypeRD("divu", Extension.I),
-        TypeRD("rem", Extension.I),
-        TypeRD("remu", Extension.I),
-
-        # RV64M
-        TypeR("mulw", Extension.I),
-        TypeRD("divw", Extension.I),
-        TypeRD("divuw", Extension.I),
-        TypeRD("remw", Extension.I),
-        TypeRD("remuw", Extension.I),
-
-        # # RV32F
-        # TypeILSF("flw", Extension.S, 0x10000000, 0x10080000),
-        # TypeILSF("fsw", Extension.S, 0x10000000, 0x10080000),
-        # TypeR4("fmadd.s", Extension.S),
-        # TypeR4("fmsub.s", Extension.S),
-        # TypeR4("fnmsub.s", Extension.S),
-        # TypeR4("fnmadd.s", Extension.S),
-        # TypeR("fadd.s", Extension.S),
-        # TypeR("fsub.s", Extension.S),
-        # TypeR("fmul.s", Extension.S),
-        # TypeR("fdiv.s", Extension.S),
-        # TypeR2("fsqrt.s", Extension.S),
-        # TypeR("fsgnj.s", Extension.S),
-        # TypeR("fsgnjn.s", Extension.S),
-        # TypeR("fsgnjx.s", Extension.S),
-        # TypeR("fmin.s", Extension.S),
-        # TypeR("fmax.s", Extension.S),
-        # TypeR2DI("fcvt.w.s", Extension.S),
-        # TypeR2DI("fcvt.wu.s", Extension.S),
-        # TypeR2DI("fmv.x.w", Extension.S),
-        # TypeRF("feq.s", Extension.S),
-        # TypeRF("flt.s", Extension.S),
-        # TypeRF("fle.s", Extension.S),
-        # TypeR2DI("fclass.s", Extension.S),
-        # TypeR2DF("fcvt.s.w", Extension.I),
-        # TypeR2DF("fcvt.s.wu", Extension.I),
-        # TypeR2DF("fmv.w.x", Extension.I), # TODO: inicializar x com um numero real
-
-        # RV32D
-        TypeILSF("fld", Extension.D, 0x10000000, 0x10080000),
-        TypeILSF("fsd", Extension.D, 0x10000000, 0x10080000),
-        TypeR4("fmadd.d", Extension.D),
-        TypeR4("fmsub.d", Extension.D),
-        TypeR4("fnmsub.d", Extension.D),
-        TypeR4("fnmadd.d", Extension.D),
-        TypeR("fadd.d", Extension.D),
-        TypeR("fsub.d", Extension.D),
-        TypeR("fmul.d", Extension.D),
-        TypeR("fdiv.d", Extension.D),
-        TypeR2("fsqrt.d", Extension.D),
-        TypeR("fsgnj.d" , Extension.D),
-        TypeR("fsgnjn.d", Extension.D),
-        TypeR("fsgnjx.d", Extension.D),
-        TypeR("fmin.d", Extension.D),
-        TypeR("fmax.d", Extension.D),
-        TypeR2("fcvt.s.d", Extension.D),
-        TypeR2("fcvt.d.s", Extension.S),
-        TypeRF("feq.d", Extension.D),
-        TypeRF("flt.d", Extension.D),
-        TypeRF("fle.d", Extension.D),
-        TypeR2DI("fclass.d", Extension.D),
-        TypeR2DI("fcvt.w.d", Extension.D),
-        TypeR2DI("fcvt.wu.d", Extension.D),
-        TypeR2DF("fcvt.d.w", Extension.I),
-        TypeR2DF("fcvt.d.wu", Extension.I),
-
-        # # RV64F
-        # TypeR2DI("fcvt.l.s", Extension.S),
-        # TypeR2DI("fcvt.lu.s", Extension.S),
-        # TypeR2DF("fcvt.s.l", Extension.I),
-        # TypeR2DF("fcvt.s.lu", Extension.I),
-
-        # RV64D
-        TypeR2DI("fcvt.l.d", Extension.D),
-        TypeR2DI("fcvt.lu.d", Extension.D),
-        TypeR2DI("fmv.x.d", Extension.D),
-        TypeR2DF("fcvt.d.l", Extension.I),
-        TypeR2DF("fcvt.d.lu", Extension.I),
-        TypeR2DF("fmv.d.x", Extension.I) # TODO: iniciar x com um valor real
-    ]
-
-    for template in templates:
-        template.reserve_destination_registers(6)
-
-        if (args.verbose):
-            print ('Instruction:' + template.instruction)
-        if (args.output is not None):
-            template.set_dir(args.output)
-        if (args.prefix is not None):
-            template.set_prefix(args.prefix)
-
-        template.generate_program(args.iterations, args.number)
+    if not args.calibrate and (args.iterations is None or args.number is None):
+        parser.error('-i and -n are required unless --calibrate is given')
+
+    calibrator = None
+    if args.calibrate:
+        calibrator = Calibrator(args.target_cycles, args.ratio)
+        if args.logs is not None:
+            calibrator.load_logs(args.logs,
+                                 BaselineIndex(os.path.join(args.output or 'test-programs', 'baselines.json')).pools,
+                                 CountIndex(os.path.join(args.output or 'test-programs', 'dynamic-counts.json')).counts)
+
+    templates = build_templates()
+    presim = None
+    dynamic = None
+    if args.presim:
+        presim = PreSimulator()
+        dynamic = CountIndex(os.path.join(args.output or 'test-programs', 'dynamic-counts.json'))
+
+    store = None
+    if args.dedup:
+        store = ContentStore(os.path.join(args.output or 'test-programs', 'content-index.json'))
+
+    pipeline = None
+    if args.pipeline:
+        if 'RISCV' not in os.environ:
+            parser.error('--pipeline requires the RISCV environment variable')
+        try:
+            pipeline = AssemblerPipeline(os.environ['RISCV'], args.bin, 'ext', args.jobs, args.keep_sources)
+        except ValueError as e:
+            parser.error(str(e))
+
+    baselines = None
+    pools = set()
+    if args.shared_baselines:
+        baselines = BaselineIndex(os.path.join(args.output or 'test-programs', 'baselines.json'))
+
+    # Builds still queued must finish even if generation stops early
+    failures = []
+    try:
+        for position in range(0, len(templates)):
+            template = templates[position]
+
+            if (args.verbose):
+                print ('Instruction:' + template.instruction)
+
+            if calibrator is not None:
+                iterations, number = calibrator.get_sizes(template.get_name())
+            else:
+                iterations, number = args.iterations, args.number
+
+            if (args.verbose):
+                print ('Size: %dx%d' % (iterations, number))
+
+            programs = None
+            for attempt in range(0, args.attempts if presim is not None else 1):
+                setup_template(template, args, store, pipeline)
+
+                try:
+                    programs = template.build_programs(iterations, number)
+                    if presim is not None:
+                        counts = [presim.run(program) for program in programs]
+                    break
+                except (SimulationError, IndexError) as e:
+                    if presim is None:
+                        raise
+
+                    print ('Rejected %s: %s' % (template.get_name(), e))
+                    programs = None
+                    template = build_template(position)
+
+            if programs is None:
+                print ('Error: no valid program for %s' % (template.get_name()))
+                continue
+
+            if presim is not None:
+                dynamic.add(template.get_stem(iterations, number), counts[1] - counts[0])
+                if (args.verbose):
+                    print ('Dynamic instructions: %d init, %d full' % (counts[0], counts[1]))
+
+            if baselines is None:
+                template.save_programs(iterations, number, programs)
+                continue
+
+            pool = template.get_family(iterations)
+            if pool not in pools:
+                template.save_baseline(args.prefix or '', iterations, programs[0])
+                pools.add(pool)
+
+            baselines.add(template.get_name(), pool)
+            template.save_programs(iterations, number, programs, False)
+    finally:
+        if pipeline is not None:
+            failures = pipeline.wait()
+
+    if store is not None:
+        store.save()
+    if baselines is not None:
+        baselines.save()
+    if dynamic is not None:
+        dynamic.save()
+
+    for stem, error in failures:
+        print ('Error: %s does not assemble\n%s' % (stem, error.rstrip()))
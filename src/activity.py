@@ -0,0 +1,230 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+import bz2
+import gzip
+import re
+
+import numpy as np
+
+_SAIF_TOKEN = re.compile(br'\(|\)|"[^"]*"|[^\s()]+')
+
+def is_activity_file(file_name):
+    name = re.sub(r'\.(gz|bz2)$', '', file_name)
+    return name.endswith(".vcd") or name.endswith(".saif")
+
+def _open(file_name):
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, 'rb')
+    if file_name.endswith(".bz2"):
+        return bz2.BZ2File(file_name, 'rb')
+    return open(file_name, 'rb')
+
+# Counts signal toggles per scope, grouping signals by the first `depth`
+# levels of their hierarchy. Dumps are streamed `chunk_size` bytes at a
+# time, so memory only grows with the number of signals.
+class ActivityReader(object):
+    def __init__(self, depth = 2, start = None, end = None, chunk_size = 1 << 22):
+        self.depth = depth
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+
+    # start and end override the window of the reader for this dump only
+    def read(self, file_name, start = None, end = None):
+        name = re.sub(r'\.(gz|bz2)$', '', file_name)
+
+        with _open(file_name) as f:
+            if name.endswith(".saif"):
+                return self.__read_saif(f)
+            return self.__read_vcd(f, self.start if start is None else start, self.end if end is None else end)
+
+    def __group(self, scopes):
+        return ".".join(scopes[:self.depth])
+
+    def __read_vcd(self, f, start, end):
+        codes = {}
+        declarations = set()
+        groups = {}
+        scopes = []
+
+        # The header is small; parse it one "... $end" declaration at a time,
+        # several of them may share a line.
+        tokens = []
+        definitions = True
+        while definitions:
+            line = f.readline()
+            if not line:
+                break
+
+            tokens.extend(line.split())
+            while b"$end" in tokens:
+                close = tokens.index(b"$end")
+                declaration = tokens[:close]
+                tokens = tokens[close + 1:]
+
+                if not declaration:
+                    continue
+
+                if declaration[0] == b"$scope":
+                    scopes.append(declaration[2].decode())
+                elif declaration[0] == b"$upscope":
+                    scopes.pop()
+                elif declaration[0] == b"$var":
+                    code = codes.setdefault(declaration[3], len(codes))
+                    group = groups.setdefault(self.__group(scopes), len(groups))
+                    declarations.add((code, group))
+                elif declaration[0] == b"$enddefinitions":
+                    definitions = False
+                    break
+
+        last = [None] * len(codes)
+        counts = np.zeros(len(codes))
+        time = 0
+        first = None
+        counting = start is None or start <= 0
+        initializing = False
+
+        while True:
+            lines = f.readlines(self.chunk_size)
+            if not lines:
+                break
+
+            changed = []
+            toggles = []
+
+            for line in lines:
+                c = line[:1]
+
+                if c == b"#":
+                    time = int(line[1:])
+                    if end is not None and time >= end:
+                        counting = False
+                        break
+                    counting = start is None or time >= start
+                    if counting and first is None:
+                        first = time
+                    continue
+
+                if c in (b"0", b"1", b"x", b"X", b"z", b"Z"):
+                    code = codes.get(line[1:].strip())
+                    value = int(c) if c in (b"0", b"1") else None
+                elif c in (b"b", b"B"):
+                    fields = line[1:].split()
+                    code = codes.get(fields[1])
+                    try:
+                        value = int(fields[0], 2)
+                    except ValueError:
+                        value = None
+                elif c in (b"r", b"R"):
+                    fields = line[1:].split()
+                    code = codes.get(fields[1])
+                    value = float(fields[0])
+                elif c == b"$":
+                    if line.startswith(b"$dumpvars"):
+                        initializing = True
+                    elif line.startswith(b"$end"):
+                        initializing = False
+                    continue
+                else:
+                    continue
+
+                if code is None:
+                    continue
+
+                previous = last[code]
+                last[code] = value
+
+                if counting and not initializing and previous is not None and value is not None and previous != value:
+                    changed.append(code)
+                    if isinstance(value, float):
+                        toggles.append(1)
+                    else:
+                        toggles.append(bin(previous ^ value).count("1"))
+
+            if changed:
+                counts += np.bincount(changed, weights=toggles, minlength=len(codes))
+
+            if end is not None and time >= end:
+                break
+
+        if end is not None:
+            time = min(time, end)
+
+        return self.__aggregate(counts, declarations, groups, max(time - (first or 0), 0))
+
+    def __read_saif(self, f):
+        groups = {}
+        changed = []
+        toggles = []
+        counts = np.zeros(0)
+        duration = 0
+
+        stack = []
+        instances = []
+        pending = None
+
+        while True:
+            lines = f.readlines(self.chunk_size)
+            if not lines:
+                break
+
+            for token in _SAIF_TOKEN.findall(b"".join(lines)):
+                if token == b"(":
+                    pending = True
+                    continue
+
+                if token == b")":
+                    keyword = stack.pop()
+                    if keyword == b"INSTANCE":
+                        instances.pop()
+                    continue
+
+                if pending:
+                    stack.append(token)
+                    pending = False
+                    continue
+
+                keyword = stack[-1] if stack else None
+                if keyword == b"INSTANCE" and len(instances) < stack.count(b"INSTANCE"):
+                    instances.append(token.strip(b'"').decode())
+                elif keyword == b"TC":
+                    group = groups.setdefault(self.__group(instances), len(groups))
+                    changed.append(group)
+                    toggles.append(int(token))
+                elif keyword == b"DURATION":
+                    duration = int(float(token))
+
+            if changed:
+                counts = np.pad(counts, (0, len(groups) - len(counts)), 'constant')
+                counts += np.bincount(changed, weights=toggles, minlength=len(groups))
+                changed = []
+                toggles = []
+
+        counts = np.pad(counts, (0, len(groups) - len(counts)), 'constant')
+        return self.__aggregate(counts, [(i, i) for i in range(0, len(groups))], groups, duration)
+
+    def __aggregate(self, counts, declarations, groups, duration):
+        totals = np.zeros(len(groups))
+
+        if declarations:
+            code, group = np.array(sorted(declarations)).T
+            totals = np.bincount(group, weights=counts[code], minlength=len(groups))
+
+        activity = {}
+        for name, index in groups.items():
+            activity[name] = float(totals[index])
+
+        return activity, duration
@@ -0,0 +1,39 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+# Maps each instruction to the pool of shared _init baselines it is
+# measured against. Every generator run adds one baseline per pool.
+class BaselineIndex(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.pools = {}
+
+        if os.path.exists(file_name):
+            with open(file_name, 'r') as f:
+                self.pools = json.load(f)
+
+    def add(self, instruction, pool):
+        self.pools[instruction] = pool
+
+    def save(self):
+        # With --pipeline no source may have created the directory
+        if os.path.dirname(self.file_name) and not os.path.exists(os.path.dirname(self.file_name)):
+            os.makedirs(os.path.dirname(self.file_name))
+
+        with open(self.file_name, 'w') as f:
+            json.dump(self.pools, f, indent=1, sort_keys=True)
@@ -39,9 +39,7 @@ class TypeRD(TypeR):
         self.srcReg.pop(0)
 
         for r in self.srcReg:
-            value = random.randint(0, 2 ** 32 - 1)
-            self.program += "        lui " + r + ", %hi(" + str(value) + ")\n"
-            self.program += "        addi " + r + ", " + r + ", %lo(" + str(value) + ")\n"
+            self._init_int_register(r, random.randint(0, 2 ** 32 - 1))
 
 # opcode shamt rs1 opcode rd opcode
 class TypeRS(InstGenerator):
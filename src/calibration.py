@@ -0,0 +1,110 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+from src.sim_logs import parse_file_name, program_stem, read_cycles
+
+import os
+import math
+import statistics as st
+
+class Calibrator(object):
+    # addi + bne closing every loop iteration
+    LOOP_OVERHEAD = 3
+
+    # Rough cycles per instruction used when no campaign log is available.
+    _DEFAULT_CPI = {
+        "jal": 2, "jalr": 2,
+        "lb": 2, "lh": 2, "lw": 2, "lbu": 2, "lhu": 2, "lwu": 2, "ld": 2,
+        "fld": 2,
+        "mul": 4, "mulh": 4, "mulhsu": 4, "mulhu": 4, "mulw": 4,
+        "div": 34, "divu": 34, "rem": 34, "remu": 34,
+        "divw": 18, "divuw": 18, "remw": 18, "remuw": 18,
+        "fmadd.d": 5, "fmsub.d": 5, "fnmsub.d": 5, "fnmadd.d": 5,
+        "fadd.d": 4, "fsub.d": 4, "fmul.d": 5,
+        "fdiv.d": 28, "fsqrt.d": 32,
+        "fcvt.s.d": 3, "fcvt.d.s": 3,
+    }
+
+    def __init__(self, target_cycles = 2048, ratio = 16.0, min_instructions = 8, max_instructions = 512):
+        self.target_cycles = target_cycles
+        self.ratio = ratio
+        self.min_instructions = min_instructions
+        self.max_instructions = max_instructions
+        self.cpi = {}
+
+    # pools maps instructions to their shared _init baseline, as saved in
+    # baselines.json, for kernels that have no _init run of their own.
+    # counts maps programs to their executed loop body instructions, as
+    # saved in dynamic-counts.json.
+    def load_logs(self, dir, pools = None, counts = None):
+        runs = {}
+        stems = {}
+
+        for file in os.listdir(dir):
+            if not file.endswith(".log"):
+                continue
+
+            name = parse_file_name(file)
+            if name is None or name.iterations is None:
+                continue
+
+            with open(os.path.join(dir, file), "r") as f:
+                cycles = read_cycles(f.read())
+
+            if cycles is None:
+                continue
+
+            key = (name.index, name.instruction, name.iterations, name.nInstructions)
+            run = runs.setdefault(key, {})
+            run[name.init] = cycles
+            if not name.init:
+                stems[key] = program_stem(file)
+
+        samples = {}
+        for (index, instruction, iterations, nInstructions), run in runs.items():
+            if False not in run or nInstructions == 0:
+                continue
+
+            init = run.get(True)
+            if init is None and pools is not None and instruction in pools:
+                init = runs.get((index, pools[instruction], iterations, 0), {}).get(True)
+            if init is None:
+                continue
+
+            executed = iterations * nInstructions
+            if counts is not None:
+                executed = counts.get(stems[(index, instruction, iterations, nInstructions)], executed)
+
+            cpi = float(run[False] - init) / executed
+            if cpi > 0.0:
+                samples.setdefault(instruction, []).append(cpi)
+
+        for instruction in samples:
+            self.cpi[instruction] = st.median(samples[instruction])
+
+    def get_cpi(self, name):
+        if name in self.cpi:
+            return self.cpi[name]
+
+        return self._DEFAULT_CPI.get(name.split("_")[0], 1)
+
+    def get_sizes(self, name):
+        cpi = self.get_cpi(name)
+
+        nInstructions = int(math.ceil(float(self.ratio * self.LOOP_OVERHEAD) / cpi))
+        nInstructions = min(max(nInstructions, self.min_instructions), self.max_instructions)
+
+        iterations = int(math.ceil(float(self.target_cycles) / (nInstructions * cpi + self.LOOP_OVERHEAD)))
+        return (max(iterations, 1), nInstructions)
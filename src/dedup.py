@@ -0,0 +1,87 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+
+# Maps the hash of each program to the first program saved with that
+# content. Programs saved later with the same content become aliases of
+# it, so only the canonical one needs to be built and simulated.
+class ContentStore(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.programs = {}
+        self.aliases = {}
+
+        if os.path.exists(file_name):
+            with open(file_name, 'r') as f:
+                data = json.load(f)
+            self.programs = data["programs"]
+            self.aliases = data["aliases"]
+
+        self.digests = dict((stem, digest) for digest, stem in self.programs.items())
+
+    @staticmethod
+    def digest(program):
+        lines = []
+        for line in program.split("\n"):
+            line = " ".join(line.split("#")[0].split())
+            if line:
+                lines.append(line)
+
+        return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+
+    # A stem saved again with new content no longer holds its old program,
+    # so it stops being the canonical copy of it. Its aliases had no file
+    # of their own and are dropped until they are saved again.
+    def __forget(self, stem):
+        digest = self.digests.pop(stem, None)
+        if digest is None:
+            return
+
+        del self.programs[digest]
+        for alias in [alias for alias in self.aliases if self.aliases[alias] == stem]:
+            del self.aliases[alias]
+
+    def add(self, stem, program):
+        digest = self.digest(program)
+        if self.digests.get(stem) != digest:
+            self.__forget(stem)
+
+        canonical = self.programs.setdefault(digest, stem)
+        self.aliases.pop(stem, None)
+
+        if canonical != stem:
+            self.aliases[stem] = canonical
+        else:
+            self.digests[stem] = digest
+
+        return canonical
+
+    def get_aliases(self):
+        aliases = {}
+        for alias in self.aliases:
+            aliases.setdefault(self.aliases[alias], []).append(alias)
+
+        return aliases
+
+    def save(self):
+        # With --pipeline no source may have created the directory
+        if os.path.dirname(self.file_name) and not os.path.exists(os.path.dirname(self.file_name)):
+            os.makedirs(os.path.dirname(self.file_name))
+
+        with open(self.file_name, 'w') as f:
+            json.dump({ "programs": self.programs, "aliases": self.aliases }, f, indent=1, sort_keys=True)
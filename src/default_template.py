@@ -14,7 +14,6 @@
 # <http://www.gnu.org/licenses/>.
 
 import random
-import string
 import os
 import numpy
 import struct
@@ -27,6 +26,18 @@ class Extension(Enum):
     D = 2
     X = 3
 
+# Value left in a register by the lui %hi / addi %lo pair of the prologue
+def _lui_addi_value(value):
+    upper = (((value + 0x800) >> 12) & 0xfffff) << 12
+    lower = value & 0xfff
+
+    if upper >> 31:
+        upper -= 1 << 32
+    if lower >> 11:
+        lower -= 1 << 12
+
+    return (upper + lower) & (2 ** 64 - 1)
+
 class InstGenerator(object):
     _templateHeader = """
         .section ".text"
@@ -103,6 +114,10 @@ end:    j end
         self.sufix = ''
         self.format = format
         self.dstReg = []
+        self.store = None
+        self.pipeline = None
+        self.table_init = False
+        self.init_table = []
 
         if self.format in (Extension.S, Extension.D):
             self.srcReg = [
@@ -124,35 +139,71 @@ end:    j end
 
         if self.format == Extension.S:
             for r in registers:
-                label = "." + r +"_DATA"
-                self.program += "        lui a5, %hi(" + label + ")\n"
-                self.program += "        flw " + r + ", %lo(" + label + ")(a5)\n"
-                self.alloc_single_value(random.choice(self._REAL_VALUES), label)
+                self._init_float_register(r, "flw", [self._single_word(random.choice(self._REAL_VALUES))])
         elif self.format == Extension.D:
             for r in registers:
-                label = "." + r +"_DATA"
-                self.program += "        lui a5, %hi(" + label + ")\n"
-                self.program += "        fld " + r + ", %lo(" + label + ")(a5)\n"
-                self.alloc_double_value(random.choice(self._REAL_VALUES), label)
+                self._init_float_register(r, "fld", self._double_words(random.choice(self._REAL_VALUES)))
         else:
             for r in registers[1:]:
-                value = random.randint(0, 2 ** 32 - 1)
-                self.program += "        lui " + r + ", %hi(" + str(value) + ")\n"
-                self.program += "        addi " + r + ", " + r + ", %lo(" + str(value) + ")\n"
-
-    def alloc_single_value(self, value, label):
-        result = 0
+                self._init_int_register(r, random.randint(0, 2 ** 32 - 1))
+
+    def _init_int_register(self, r, value):
+        if self.table_init:
+            self.init_table.append(("ld", r, value))
+            return
+
+        self.program += "        lui " + r + ", %hi(" + str(value) + ")\n"
+        self.program += "        addi " + r + ", " + r + ", %lo(" + str(value) + ")\n"
+
+    def _init_float_register(self, r, load, words):
+        if self.table_init:
+            self.init_table.append((load, r, words))
+            return
+
+        label = "." + r +"_DATA"
+        self.program += "        lui a5, %hi(" + label + ")\n"
+        self.program += "        " + load + " " + r + ", %lo(" + label + ")(a5)\n"
+        self.__alloc_words(label, words)
+
+    # Packs the values collected by _init_*_register in one 8 byte aligned
+    # block and loads them from a single base pointer. a5 holds that
+    # pointer, so it is the last register to be loaded.
+    def __add_init_table(self):
+        if not self.init_table:
+            return
+
+        entries = sorted(self.init_table, key=lambda entry: entry[1] in ('x15', 'a5'))
+        self.init_table = []
+
+        self.program += "        lui a5, %hi(.init_table)\n"
+        self.program += "        addi a5, a5, %lo(.init_table)\n"
+        self._templateFooter += "        .balign 8\n.init_table:\n"
+
+        for offset, (load, r, value) in enumerate(entries):
+            self.program += "        %s %s, %d(a5)\n" % (load, r, offset * 8)
+
+            if load != "ld":
+                words = value + [0] * (2 - len(value))
+                self._templateFooter += "        .word  %d\n        .word  %d\n" % (words[0], words[1])
+            elif isinstance(value, str):
+                self._templateFooter += "        .dword %s\n" % (value)
+            else:
+                self._templateFooter += "        .dword 0x%x\n" % (_lui_addi_value(value))
+
+    def __alloc_words(self, label, words):
+        self._templateFooter += "%s:\n" % (label)
+        for word in words:
+            self._templateFooter += "        .word  %d\n" % (word)
+
+    def _single_word(self, value):
         bstr = bin(struct.unpack('i',struct.pack('f',value))[0])
 
         if (value > 0.0):
-            result = int(bstr[2::].zfill(32)[0:32],2)
+            return int(bstr[2::].zfill(32)[0:32],2)
         else:
-            result = int(bstr[3::].zfill(32)[0:32],2) or 0x80000000
-
-        self._templateFooter += "%s:\n\
-        .word  %d\n" % (label, result)
+            return int(bstr[3::].zfill(32)[0:32],2) or 0x80000000
 
-    def alloc_double_value(self, value, label):
+    def _double_words(self, value):
         bstr = bin(struct.unpack('Q',struct.pack('d',value))[0])[2::].zfill(64)
         right = int(bstr[32:64],2)
         left = 0
@@ -162,10 +213,13 @@ end:    j end
         else:
             left = int(bstr[0:32],2) or 0x80000000
 
+        return [right, left]
 
-        self._templateFooter += "%s:\n\
-        .word  %d\n\
-        .word  %d\n" % (label, right, left)
+    def alloc_single_value(self, value, label):
+        self.__alloc_words(label, [self._single_word(value)])
+
+    def alloc_double_value(self, value, label):
+        self.__alloc_words(label, self._double_words(value))
 
     def reserve_destination_registers(self, number):
         for i in range(0, number):
@@ -177,7 +231,7 @@ end:    j end
         return '# No template given\n'
 
     def __add_header(self, iterations):
-        self.program += string.replace(self._templateHeader, '$iterations', str(iterations))
+        self.program += self._templateHeader.replace('$iterations', str(iterations))
 
     def __add_loop_label(self):
         self.program += "\n.loop:\n"
@@ -185,27 +239,42 @@ end:    j end
     def __add_footer(self):
         self.program += self._templateFooter
 
-    def __save_program(self, iterations, nInstructions):
+    def __save_program(self, iterations, nInstructions, program):
+        self.__write_program(self.get_stem(iterations, nInstructions, self.sufix), program)
+
+    def __write_program(self, stem, program):
+        # Identical programs are simulated once; see src/dedup.py
+        if self.store is not None and self.store.add(stem, program) != stem:
+            # Drop the source left by a previous campaign under this name
+            if os.path.exists(os.path.join(self.dir, stem + '.s')):
+                os.remove(os.path.join(self.dir, stem + '.s'))
+            return
+
+        if self.pipeline is not None:
+            self.pipeline.add(stem, program)
+            if not self.pipeline.keep_sources:
+                return
+
         if not os.path.exists(self.dir):
             os.makedirs(self.dir)
 
-        file_name = os.path.join(self.dir,
-                                   self.prefix +
-                                   self.instruction +
-                                   '_' +
-                                   str(iterations) +
-                                   'x' +
-                                   str(nInstructions) +
-                                   self.sufix +
-                                   '.s')
-        open(file_name, 'wt').write(self.program)
+        open(os.path.join(self.dir, stem + '.s'), 'wt').write(program)
 
-    def generate_program(self, iterations, nInstructions):
+    def get_stem(self, iterations, nInstructions, sufix = ""):
+        return (self.prefix +
+                self.instruction +
+                '_' +
+                str(iterations) +
+                'x' +
+                str(nInstructions) +
+                sufix)
+
+    def build_programs(self, iterations, nInstructions):
         self.__add_header(iterations)
         self.init_registers()
+        self.__add_init_table()
         self.__add_loop_label()
 
-        self.sufix = "_init"
         self.program += "        # Empty template\n"
         code = ""
 
@@ -213,15 +282,49 @@ end:    j end
             code += self._add_random_instruction()
 
         self.__add_footer()
-        self.__save_program(iterations, nInstructions)
+        init = self.program
 
-        self.sufix = ""
         self.program = self.program.replace("        # Empty template\n", code)
-        self.__save_program(iterations, nInstructions)
+        return (init, self.program)
+
+    def get_programs(self, iterations, nInstructions):
+        init, full = self.build_programs(iterations, nInstructions)
+        return [(self.get_stem(iterations, nInstructions, "_init"), init),
+                (self.get_stem(iterations, nInstructions), full)]
+
+    def save_programs(self, iterations, nInstructions, programs, baseline = True):
+        if baseline:
+            self.sufix = "_init"
+            self.__save_program(iterations, nInstructions, programs[0])
 
+        self.sufix = ""
+        self.__save_program(iterations, nInstructions, programs[1])
+
+    def generate_program(self, iterations, nInstructions):
+        self.save_programs(iterations, nInstructions, self.build_programs(iterations, nInstructions))
+
+    # Templates of the same class and extension share the prologue and loop
+    # of their _init programs, so one baseline can serve all of them.
+    def get_family(self, iterations):
+        return "pool-%s-%s-%d" % (type(self).__name__, self.format.name, iterations)
+
+    def save_baseline(self, prefix, iterations, program):
+        self.__write_program(prefix + self.get_family(iterations) + '_' + str(iterations) + 'x0_init', program)
+
+    def get_name(self):
+        return self.instruction
 
     def set_dir(self, dir):
         self.dir = dir
 
     def set_prefix(self, prefix):
         self.prefix = prefix
+
+    def set_store(self, store):
+        self.store = store
+
+    def set_pipeline(self, pipeline):
+        self.pipeline = pipeline
+
+    def set_table_init(self, enabled):
+        self.table_init = enabled
@@ -0,0 +1,358 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+_SHF_EXECINSTR = 0x4
+
+_BRANCHES = { 0: "beq", 1: "bne", 4: "blt", 5: "bge", 6: "bltu", 7: "bgeu" }
+_LOADS = { 0: "lb", 1: "lh", 2: "lw", 3: "ld", 4: "lbu", 5: "lhu", 6: "lwu" }
+_STORES = { 0: "sb", 1: "sh", 2: "sw", 3: "sd" }
+_FLOAT_LOADS = { 2: "flw", 3: "fld" }
+_FLOAT_STORES = { 2: "fsw", 3: "fsd" }
+_FUSED = { 0x43: "fmadd", 0x47: "fmsub", 0x4b: "fnmsub", 0x4f: "fnmadd" }
+_FORMATS = { 0: "s", 1: "d" }
+_INTEGERS = { 0: "w", 1: "wu", 2: "l", 3: "lu" }
+
+_OP_IMM = { 0: "addi", 2: "slti", 3: "sltiu", 4: "xori", 6: "ori", 7: "andi", 1: "slli" }
+_OP = {
+    0x00: { 0: "add", 1: "sll", 2: "slt", 3: "sltu", 4: "xor", 5: "srl", 6: "or", 7: "and" },
+    0x20: { 0: "sub", 5: "sra" },
+    0x01: { 0: "mul", 1: "mulh", 2: "mulhsu", 3: "mulhu", 4: "div", 5: "divu", 6: "rem", 7: "remu" },
+}
+_OP_32 = {
+    0x00: { 0: "addw", 1: "sllw", 5: "srlw" },
+    0x20: { 0: "subw", 5: "sraw" },
+    0x01: { 0: "mulw", 4: "divw", 5: "divuw", 6: "remw", 7: "remuw" },
+}
+_OP_FP = { 0x00: "fadd", 0x01: "fsub", 0x02: "fmul", 0x03: "fdiv", 0x0b: "fsqrt" }
+
+# RVC instructions are named after the base instruction they expand to
+_C0 = { 0: "addi", 1: "fld", 2: "lw", 3: "ld", 5: "fsd", 6: "sw", 7: "sd" }
+_C1 = { 0: "addi", 1: "addiw", 2: "addi", 5: "jal", 6: "beq", 7: "bne" }
+_C1_ALU = { 0: "srli", 1: "srai", 2: "andi" }
+_C1_OP = { 0: "sub", 1: "xor", 2: "or", 3: "and", 4: "subw", 5: "addw" }
+_C2 = { 0: "slli", 1: "fld", 2: "lw", 3: "ld", 5: "fsd", 6: "sw", 7: "sd" }
+
+def _sext(value, bits):
+    if value >> (bits - 1):
+        return value - (1 << bits)
+    return value
+
+def read_text_sections(file_name):
+    with open(file_name, 'rb') as f:
+        elf = f.read()
+
+    if elf[:4] != b'\x7fELF' or bytearray(elf[4:6]) != bytearray([2, 1]):
+        raise ValueError("%s is not a little endian ELF64 file" % file_name)
+
+    shoff, = struct.unpack_from('<Q', elf, 0x28)
+    shentsize, shnum = struct.unpack_from('<HH', elf, 0x3a)
+
+    sections = []
+    for i in range(0, shnum):
+        header = struct.unpack_from('<IIQQQQIIQQ', elf, shoff + i * shentsize)
+        flags, addr, offset, size = header[2:6]
+
+        if flags & _SHF_EXECINSTR and size > 0:
+            sections.append((addr, elf[offset:offset + size]))
+
+    return sections
+
+def _length(word):
+    return 4 if word & 0x3 == 0x3 else 2
+
+# Splits a text section into (offset, instruction) pairs, 16-bit RVC
+# instructions included.
+def _split_instructions(text):
+    instructions = []
+    offset = 0
+
+    while offset + 2 <= len(text):
+        word, = struct.unpack_from('<H', text, offset)
+        if _length(word) == 4:
+            if offset + 4 > len(text):
+                break
+            word, = struct.unpack_from('<I', text, offset)
+
+        instructions.append((offset, word))
+        offset += _length(word)
+
+    return instructions
+
+def _decode_compressed(half):
+    quadrant = half & 0x3
+    funct3 = half >> 13
+    rd = (half >> 7) & 0x1f
+    rs2 = (half >> 2) & 0x1f
+
+    if half == 0:
+        return None
+    if quadrant == 0:
+        return _C0.get(funct3)
+    if quadrant == 1:
+        if funct3 == 3:
+            return "addi" if rd == 2 else "lui"
+        if funct3 == 4:
+            if (half >> 10) & 0x3 != 3:
+                return _C1_ALU[(half >> 10) & 0x3]
+            return _C1_OP.get(((half >> 12) & 1) << 2 | (half >> 5) & 0x3)
+        return _C1.get(funct3)
+    if funct3 == 4:
+        if rs2 != 0:
+            return "add"
+        if half >> 12 & 1 and rd == 0:
+            return "system"
+        return "jalr"
+    return _C2.get(funct3)
+
+# Decodes the mnemonic of a RV64IMFDC instruction, using the names of the
+# power table. Returns None for anything else.
+def decode(word):
+    if _length(word) == 2:
+        return _decode_compressed(word & 0xffff)
+
+    opcode = word & 0x7f
+    funct3 = (word >> 12) & 0x7
+    funct7 = word >> 25
+    rs2 = (word >> 20) & 0x1f
+
+    if opcode == 0x37:
+        return "lui"
+    if opcode == 0x17:
+        return "auipc"
+    if opcode == 0x6f:
+        return "jal"
+    if opcode == 0x67:
+        return "jalr"
+    if opcode == 0x63:
+        return _BRANCHES.get(funct3)
+    if opcode == 0x03:
+        return _LOADS.get(funct3)
+    if opcode == 0x23:
+        return _STORES.get(funct3)
+    if opcode == 0x07:
+        return _FLOAT_LOADS.get(funct3)
+    if opcode == 0x27:
+        return _FLOAT_STORES.get(funct3)
+
+    if opcode == 0x13:
+        if funct3 == 5:
+            return "srai" if word >> 30 & 1 else "srli"
+        return _OP_IMM.get(funct3)
+    if opcode == 0x1b:
+        if funct3 == 0:
+            return "addiw"
+        if funct3 == 1:
+            return "slliw"
+        if funct3 == 5:
+            return "sraiw" if word >> 30 & 1 else "srliw"
+        return None
+    if opcode == 0x33:
+        return _OP.get(funct7, {}).get(funct3)
+    if opcode == 0x3b:
+        return _OP_32.get(funct7, {}).get(funct3)
+
+    if opcode in _FUSED:
+        fmt = _FORMATS.get(funct7 & 0x3)
+        return _FUSED[opcode] + "." + fmt if fmt else None
+
+    if opcode == 0x53:
+        fmt = _FORMATS.get(funct7 & 0x3)
+        op = funct7 >> 2
+        if fmt is None:
+            return None
+        if op in _OP_FP:
+            return _OP_FP[op] + "." + fmt
+        if op == 0x04:
+            return { 0: "fsgnj", 1: "fsgnjn", 2: "fsgnjx" }.get(funct3, "?") + "." + fmt
+        if op == 0x05:
+            return { 0: "fmin", 1: "fmax" }.get(funct3, "?") + "." + fmt
+        if op == 0x08:
+            return "fcvt." + fmt + "." + _FORMATS.get(rs2, "?")
+        if op == 0x14:
+            return { 0: "fle", 1: "flt", 2: "feq" }.get(funct3, "?") + "." + fmt
+        if op == 0x18:
+            return "fcvt." + _INTEGERS.get(rs2, "?") + "." + fmt
+        if op == 0x1a:
+            return "fcvt." + fmt + "." + _INTEGERS.get(rs2, "?")
+        if op == 0x1c:
+            if funct3 == 1:
+                return "fclass." + fmt
+            return "fmv.x." + ("w" if fmt == "s" else "d")
+        if op == 0x1e:
+            return "fmv." + ("w" if fmt == "s" else "d") + ".x"
+        return None
+
+    if opcode == 0x73:
+        return "system"
+    if opcode == 0x0f:
+        return "fence"
+
+    return None
+
+def _target(word, pc):
+    if _length(word) == 2:
+        quadrant = word & 0x3
+        funct3 = (word >> 13) & 0x7
+
+        if quadrant == 1 and funct3 == 5:
+            imm = (((word >> 12) & 1) << 11) | (((word >> 11) & 1) << 4) | (((word >> 9) & 0x3) << 8) | (((word >> 8) & 1) << 10) | \
+                  (((word >> 7) & 1) << 6) | (((word >> 6) & 1) << 7) | (((word >> 3) & 0x7) << 1) | (((word >> 2) & 1) << 5)
+            return pc + _sext(imm, 12)
+        if quadrant == 1 and funct3 in (6, 7):
+            imm = (((word >> 12) & 1) << 8) | (((word >> 10) & 0x3) << 3) | (((word >> 5) & 0x3) << 6) | (((word >> 3) & 0x3) << 1) | \
+                  (((word >> 2) & 1) << 5)
+            return pc + _sext(imm, 9)
+        return None
+
+    opcode = word & 0x7f
+
+    if opcode == 0x6f:
+        imm = ((word >> 31) << 20) | (((word >> 12) & 0xff) << 12) | (((word >> 20) & 1) << 11) | (((word >> 21) & 0x3ff) << 1)
+        return pc + _sext(imm, 21)
+    if opcode == 0x63:
+        imm = ((word >> 31) << 12) | (((word >> 7) & 1) << 11) | (((word >> 25) & 0x3f) << 5) | (((word >> 8) & 0xf) << 1)
+        return pc + _sext(imm, 13)
+
+    return None
+
+# Splits the text sections of a binary into basic blocks and keeps one
+# energy vector (leakage, internal, switching) per block. Both the block
+# partition of each text section and the vector of each block are cached,
+# by section content and by block content and power table, so a binary
+# seen before is estimated without decoding it again. The table must
+# hold energy per executed instruction, as written by gen-power-table.py
+# --normalize.
+class EnergyEstimator(object):
+    def __init__(self, energy_table, cache_file = None):
+        self.energy = {}
+        for instruction in energy_table:
+            entry = energy_table[instruction][0]
+            if not entry.get("normalized", False):
+                raise ValueError("%s has no energy per instruction, generate the table with --normalize" % (instruction))
+            self.energy[instruction] = (entry["leakage"], entry["internal"], entry["switching"])
+
+        self.table_digest = hashlib.sha1(json.dumps(energy_table, sort_keys=True).encode()).hexdigest()
+        self.cache_file = cache_file
+        self.cache = { "sections": {}, "blocks": {} }
+        self.unknown = {}
+
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+            # Caches of older versions hold bare block vectors; start over
+            if "sections" in cache and "blocks" in cache:
+                self.cache = cache
+
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, 3))
+
+    def load_binary(self, file_name):
+        starts = []
+        vectors = []
+
+        for address, text in read_text_sections(file_name):
+            key = hashlib.sha1(struct.pack('<Q', address) + bytes(text)).hexdigest()
+            if key not in self.cache["sections"]:
+                self.cache["sections"][key] = self.__partition(address, text)
+
+            for begin, end in self.cache["sections"][key]:
+                starts.append(address + begin)
+                vectors.append(self.__block_energy(text[begin:end]))
+
+        order = np.argsort(starts, kind='mergesort')
+        self.starts = np.array(starts, dtype=np.int64)[order]
+        self.vectors = np.array(vectors).reshape(-1, 3)[order]
+
+    # Returns the [begin, end) byte offsets of the basic blocks of a section
+    def __partition(self, address, text):
+        instructions = _split_instructions(text)
+        offsets = [offset for offset, word in instructions]
+        leaders = set([0])
+
+        for offset, word in instructions:
+            mnemonic = decode(word)
+            if mnemonic in ("jal", "jalr", "system") or mnemonic in _BRANCHES.values():
+                leaders.add(offset + _length(word))
+                target = _target(word, address + offset)
+                if target is not None and address <= target < address + len(text):
+                    leaders.add(target - address)
+
+        # Leaders that fall inside an instruction are not block starts
+        valid = set(offsets)
+        leaders = sorted(l for l in leaders if l in valid)
+        ends = leaders[1:] + [offsets[-1] + _length(instructions[-1][1])] if instructions else []
+
+        return [[begin, end] for begin, end in zip(leaders, ends)]
+
+    # Instructions without energy data are counted in self.unknown, also
+    # when the block comes from the cache.
+    def __block_energy(self, code):
+        key = hashlib.sha1(self.table_digest.encode() + bytes(code)).hexdigest()
+
+        if key not in self.cache["blocks"]:
+            vector = [0.0, 0.0, 0.0]
+            unknown = {}
+
+            for offset, word in _split_instructions(code):
+                mnemonic = decode(word)
+                if mnemonic not in self.energy:
+                    unknown[str(mnemonic)] = unknown.get(str(mnemonic), 0) + 1
+                    continue
+
+                for i in range(0, 3):
+                    vector[i] += self.energy[mnemonic][i]
+
+            self.cache["blocks"][key] = { "vector": vector, "unknown": unknown }
+
+        entry = self.cache["blocks"][key]
+        for mnemonic in entry["unknown"]:
+            self.unknown[mnemonic] = self.unknown.get(mnemonic, 0) + entry["unknown"][mnemonic]
+
+        return entry["vector"]
+
+    # Samples or block counts are attributed to the block holding their address.
+    def estimate(self, addresses, counts):
+        blocks = np.searchsorted(self.starts, np.asarray(addresses, dtype=np.int64), side='right') - 1
+        valid = blocks >= 0
+
+        block_counts = np.bincount(blocks[valid], weights=np.asarray(counts, dtype=np.float64)[valid], minlength=len(self.starts))
+        return np.dot(block_counts, self.vectors), block_counts
+
+    def save_cache(self):
+        if self.cache_file is not None:
+            with open(self.cache_file, 'w') as f:
+                json.dump(self.cache, f)
+
+def read_profile(file_name):
+    addresses = []
+    counts = []
+
+    with open(file_name, 'r') as f:
+        for line in f:
+            fields = line.split("#")[0].replace(":", " ").split()
+            if len(fields) < 2:
+                continue
+
+            addresses.append(int(fields[0], 16))
+            counts.append(float(fields[1]))
+
+    return addresses, counts
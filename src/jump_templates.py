@@ -24,9 +24,12 @@ class TypeJ(InstGenerator):
         InstGenerator.__init__(self, instruction, format)
         self.jump_table = []
 
+    # Every slot holds a jump and the chain visits all of them, ending on a
+    # label placed after the last slot, so a body of nInstructions slots
+    # executes nInstructions jumps per iteration.
     def __gen_jump_table(self, nInstructions):
-        addr_table = random.sample(range(1, nInstructions - 1), nInstructions - 2)
-        addr_table.append(nInstructions - 1)
+        addr_table = random.sample(range(1, nInstructions), nInstructions - 1)
+        addr_table.append(nInstructions)
 
         jump_table = numpy.empty(nInstructions,  dtype=object)
 
@@ -35,12 +38,12 @@ class TypeJ(InstGenerator):
             jump_table[curr] = self._build_instruction(str(curr), str(jmp))
             curr = jmp
 
-        jump_table[nInstructions-1] = ".label" + str(curr) + ":\n"
+        jump_table[nInstructions-1] += ".label" + str(curr) + ":\n"
         return jump_table.tolist()
 
-    def generate_program(self, iterations, nInstructions):
+    def build_programs(self, iterations, nInstructions):
         self.jump_table = self.__gen_jump_table(nInstructions)
-        super(TypeJ, self).generate_program(iterations, nInstructions)
+        return super(TypeJ, self).build_programs(iterations, nInstructions)
 
     def _build_instruction(self, id, addr):
         return ".label%s:\n        %s %s, .label%s\n" % (id,
@@ -48,8 +51,10 @@ class TypeJ(InstGenerator):
                                                  random.choice(self.srcReg),
                                                  addr)
 
+    # A fixed set in a fixed order, so the _init programs of every replica
+    # are identical and deduplicate
     def init_registers(self):
-        for r in self.srcReg[1:]:
+        for r in self._ALL_VALID_INT_TGTS:
             self.program += "        xor %s, %s, %s\n" % (r, r, r)
 
     def _add_random_instruction(self):
@@ -58,8 +63,7 @@ class TypeJ(InstGenerator):
 class TypeJR(TypeJ):
     def init_registers(self):
         for r in self.srcReg[1:]:
-            self.program += "        lui " + r + ", %hi(.loop)\n"
-            self.program += "        addi " + r + ", " + r + ", %lo(.loop)\n"
+            self._init_int_register(r, ".loop")
 
     def _build_instruction(self, id, addr):
         addr = str(int(addr) * 4);
@@ -76,7 +80,7 @@ class TypeB(TypeJ):
 
     def __init__(self, instruction, format, cmp_method, base_name = ""):
         InstGenerator.__init__(self, instruction, format)
-        self.init_list = ""
+        self.init_values = []
         self.prefix = base_name
         self.base_name = base_name
         self.cmp_method = cmp_method
@@ -89,8 +93,7 @@ class TypeB(TypeJ):
 
         if self.cmp_method == TypeB.EQUAL_TST:
             for r in self.srcReg[1:]:
-                self.init_list += "        lui " + r + ", %hi(" + str(self.seed) + ")\n"
-                self.init_list += "        addi " + r + ", " + r + ", %lo(" + str(self.seed) + ")\n"
+                self.init_values.append((r, self.seed))
         else:
             for r in self.srcReg[1:]:
                 value = self.samples.pop()
@@ -100,14 +103,20 @@ class TypeB(TypeJ):
                 else:
                     self.lower_list.append(r)
 
-                self.init_list += "        lui " + r + ", %hi(" + str(value) + ")\n"
-                self.init_list += "        addi " + r + ", " + r + ", %lo(" + str(value) + ")\n"
+                self.init_values.append((r, value))
 
     def set_prefix(self, prefix):
         self.prefix = prefix + self.base_name
 
+    def get_name(self):
+        if self.base_name:
+            return self.instruction + "_" + self.base_name.strip("_")
+
+        return self.instruction
+
     def init_registers(self):
-        self.program += self.init_list
+        for r, value in self.init_values:
+            self._init_int_register(r, value)
 
     def _build_instruction(self, id, addr):
         if self.cmp_method == TypeB.EQUAL_TST:
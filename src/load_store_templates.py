@@ -32,9 +32,7 @@ class TypeILS(InstGenerator):
 
     def init_registers(self):
         for r in self.srcReg[1:]:
-            value = self._get_base_addr()
-            self.program += "        lui " + r + ", %hi(" + str(value) + ")\n"
-            self.program += "        addi " + r + ", " + r + ", %lo(" + str(value) + ")\n"
+            self._init_int_register(r, self._get_base_addr())
 
     def _add_random_instruction(self):
         return "        %s %s, %d(%s)\n" % (self.instruction,
@@ -47,9 +45,7 @@ class TypeILSF(TypeILS):
         super(TypeILS, self).init_registers()
 
         for r in self._ALL_VALID_INT_TGTS:
-            value = self._get_base_addr()
-            self.program += "        lui " + r + ", %hi(" + str(value) + ")\n"
-            self.program += "        addi " + r + ", " + r + ", %lo(" + str(value) + ")\n"
+            self._init_int_register(r, self._get_base_addr())
 
     def _add_random_instruction(self):
         return "        %s %s, %d(%s)\n" % (self.instruction,
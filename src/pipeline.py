@@ -0,0 +1,78 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+from multiprocessing.pool import ThreadPool
+
+import os
+import subprocess
+
+# Assembles programs straight from memory: the source is streamed to gcc
+# over stdin and only the binary and its hex image reach the disk. Builds
+# run in a thread pool while the generator keeps producing programs.
+class AssemblerPipeline(object):
+    # Same flags as the makefile
+    CFLAGS = ['-DPREALLOCATE=1', '-march=rv64imfd', '-mcmodel=medany', '-static', '-std=gnu99', '-O0']
+    LDFLAGS = ['-static', '-nostdlib', '-nostartfiles', '-lm', '-lgcc']
+
+    def __init__(self, riscv, dir = 'bin', common = 'ext', jobs = 4, keep_sources = False):
+        self.cc = os.path.join(riscv, 'bin', 'riscv64-unknown-elf-gcc')
+        self.hex = os.path.join(riscv, 'bin', 'elf2hex')
+
+        # Fail before any program is generated, as sources are not kept
+        for tool in (self.cc, self.hex):
+            if not os.access(tool, os.X_OK):
+                raise ValueError("%s is not an executable, check $RISCV" % (tool))
+
+        self.dir = dir
+        self.common = common
+        self.keep_sources = keep_sources
+        self.pool = ThreadPool(jobs)
+        self.results = []
+
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+
+    def add(self, stem, program):
+        self.results.append(self.pool.apply_async(self.__build, (stem, program.encode())))
+
+    def __build(self, stem, program):
+        binary = os.path.join(self.dir, stem + '.riscv')
+
+        try:
+            cc = subprocess.Popen([self.cc] + self.CFLAGS +
+                                  ['-I', self.common + '/', '-o', binary, '-x', 'assembler', '-'] +
+                                  self.LDFLAGS + ['-T', os.path.join(self.common, 'boot.ld')],
+                                  stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            error = cc.communicate(program)[1]
+            if cc.returncode != 0:
+                return (stem, error.decode())
+
+            with open(binary + '.hex', 'wb') as f:
+                elf2hex = subprocess.Popen([self.hex, '8', '4096', binary], stdout=f, stderr=subprocess.PIPE)
+                error = elf2hex.communicate()[1]
+            if elf2hex.returncode != 0:
+                return (stem, error.decode())
+        except OSError as e:
+            return (stem, str(e))
+
+        return (stem, None)
+
+    # Waits for every build and returns the (stem, error) of the failed ones.
+    def wait(self):
+        self.pool.close()
+        self.pool.join()
+
+        results = [result.get() for result in self.results]
+        return [(stem, error) for stem, error in results if error is not None]
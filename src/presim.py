@@ -0,0 +1,609 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+import math
+import re
+import struct
+
+_MASK32 = 2 ** 32 - 1
+_MASK64 = 2 ** 64 - 1
+_BOX32 = _MASK64 ^ _MASK32
+
+_INT_REGISTERS = dict([("x%d" % i, i) for i in range(0, 32)] +
+    list(zip(["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1",
+              "a0", "a1", "a2", "a3", "a4", "a5", "a6", "a7", "s2", "s3",
+              "s4", "s5", "s6", "s7", "s8", "s9", "s10", "s11", "t3", "t4",
+              "t5", "t6"], range(0, 32))))
+
+_FLOAT_REGISTERS = dict(("f%d" % i, i) for i in range(0, 32))
+
+_MEMORY_OPERAND = re.compile(r'^(.*)\((\w+)\)$')
+_RELOCATION = re.compile(r'^%(hi|lo)\((.*)\)$')
+
+def _sext(value, bits):
+    value &= (1 << bits) - 1
+    if value >> (bits - 1):
+        return value - (1 << bits)
+    return value
+
+def _signed(value):
+    return _sext(value, 64)
+
+def _word(value):
+    return _sext(value, 32) & _MASK64
+
+def _div(a, b):
+    q = abs(a) // abs(b)
+    return -q if (a < 0) != (b < 0) else q
+
+def _rem(a, b):
+    return a - _div(a, b) * b
+
+def _bits_to_double(bits):
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+def _double_to_bits(value):
+    return struct.unpack('<Q', struct.pack('<d', value))[0]
+
+def _bits_to_single(bits):
+    if bits & _BOX32 != _BOX32:
+        return float('nan')
+    return struct.unpack('<f', struct.pack('<I', bits & _MASK32))[0]
+
+def _single_to_bits(value):
+    try:
+        bits = struct.unpack('<I', struct.pack('<f', value))[0]
+    except OverflowError:
+        bits = 0xff800000 if value < 0.0 else 0x7f800000
+    return _BOX32 | bits
+
+def _to_int(value, bits, unsigned):
+    if unsigned:
+        low, high = 0, 2 ** bits - 1
+    else:
+        low, high = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+    if math.isnan(value):
+        return high
+    if math.isinf(value):
+        return high if value > 0.0 else low
+
+    return min(max(int(round(value)), low), high)
+
+def _fclass(value, bits, single):
+    sign = bits >> (31 if single else 63) & 1
+
+    if math.isnan(value):
+        quiet = bits >> (22 if single else 51) & 1
+        return 1 << (9 if quiet else 8)
+    if math.isinf(value):
+        return 1 << (0 if sign else 7)
+    if value == 0.0:
+        return 1 << (3 if sign else 4)
+
+    exponent = bits >> 23 & 0xff if single else bits >> 52 & 0x7ff
+    if exponent == 0:
+        return 1 << (2 if sign else 5)
+    return 1 << (1 if sign else 6)
+
+class SimulationError(Exception):
+    pass
+
+class PreSimulator(object):
+    EXIT_ADDRESS = 0x1FF0
+    SECTION_ALIGNMENT = 512
+
+    _FORMATS = { 1: '<B', 2: '<H', 4: '<I', 8: '<Q' }
+
+    _LOADS = {
+        "lb": (1, True), "lh": (2, True), "lw": (4, True), "ld": (8, True),
+        "lbu": (1, False), "lhu": (2, False), "lwu": (4, False),
+        "flw": (4, None), "fld": (8, None),
+    }
+
+    _STORES = {
+        "sb": 1, "sh": 2, "sw": 4, "sd": 8, "fsw": 4, "fsd": 8,
+    }
+
+    _BRANCHES = {
+        "beq": lambda a, b: a == b,
+        "bne": lambda a, b: a != b,
+        "blt": lambda a, b: _signed(a) < _signed(b),
+        "bge": lambda a, b: _signed(a) >= _signed(b),
+        "bltu": lambda a, b: a < b,
+        "bgeu": lambda a, b: a >= b,
+    }
+
+    _ALU = {
+        "add": lambda a, b: (a + b) & _MASK64,
+        "sub": lambda a, b: (a - b) & _MASK64,
+        "sll": lambda a, b: (a << (b & 63)) & _MASK64,
+        "srl": lambda a, b: a >> (b & 63),
+        "sra": lambda a, b: (_signed(a) >> (b & 63)) & _MASK64,
+        "slt": lambda a, b: int(_signed(a) < _signed(b)),
+        "sltu": lambda a, b: int(a < b),
+        "xor": lambda a, b: a ^ b,
+        "or": lambda a, b: a | b,
+        "and": lambda a, b: a & b,
+        "addw": lambda a, b: _word(a + b),
+        "subw": lambda a, b: _word(a - b),
+        "sllw": lambda a, b: _word(a << (b & 31)),
+        "srlw": lambda a, b: _word((a & _MASK32) >> (b & 31)),
+        "sraw": lambda a, b: _word(_sext(a, 32) >> (b & 31)),
+        "mul": lambda a, b: (a * b) & _MASK64,
+        "mulh": lambda a, b: ((_signed(a) * _signed(b)) >> 64) & _MASK64,
+        "mulhsu": lambda a, b: ((_signed(a) * b) >> 64) & _MASK64,
+        "mulhu": lambda a, b: (a * b) >> 64,
+        "mulw": lambda a, b: _word(a * b),
+    }
+
+    _DIVISIONS = {
+        "div": lambda a, b: _div(_signed(a), _signed(b)) & _MASK64,
+        "divu": lambda a, b: a // b,
+        "rem": lambda a, b: _rem(_signed(a), _signed(b)) & _MASK64,
+        "remu": lambda a, b: a % b,
+        "divw": lambda a, b: _word(_div(_sext(a, 32), _sext(b, 32))),
+        "divuw": lambda a, b: _word((a & _MASK32) // (b & _MASK32)),
+        "remw": lambda a, b: _word(_rem(_sext(a, 32), _sext(b, 32))),
+        "remuw": lambda a, b: _word((a & _MASK32) % (b & _MASK32)),
+    }
+
+    _IMMEDIATES = {
+        "addi": "add", "slti": "slt", "sltiu": "sltu", "xori": "xor",
+        "ori": "or", "andi": "and", "slli": "sll", "srli": "srl",
+        "srai": "sra", "addiw": "addw", "slliw": "sllw", "srliw": "srlw",
+        "sraiw": "sraw",
+    }
+
+    _FLOAT_ARITHMETIC = {
+        "fadd": lambda a, b: a + b,
+        "fsub": lambda a, b: a - b,
+        "fmul": lambda a, b: a * b,
+        "fmin": lambda a, b: b if math.isnan(a) else a if math.isnan(b) else min(a, b),
+        "fmax": lambda a, b: b if math.isnan(a) else a if math.isnan(b) else max(a, b),
+    }
+
+    _FLOAT_FUSED = {
+        "fmadd": lambda a, b, c: a * b + c,
+        "fmsub": lambda a, b, c: a * b - c,
+        "fnmsub": lambda a, b, c: -(a * b) + c,
+        "fnmadd": lambda a, b, c: -(a * b) - c,
+    }
+
+    _FLOAT_COMPARE = {
+        "feq": lambda a, b: int(a == b),
+        "flt": lambda a, b: int(a < b),
+        "fle": lambda a, b: int(a <= b),
+    }
+
+    def __init__(self, dataAddress = 0x10000000, endAddress = 0x10080000, max_steps = 2 * 10 ** 6):
+        self.dataAddress = dataAddress
+        self.endAddress = endAddress
+        self.max_steps = max_steps
+
+    def run(self, program):
+        text, rodata, labels = self.__assemble(program)
+        code = self.__decode(text, labels)
+
+        self.x = [0] * 32
+        self.f = [0] * 32
+        self.rodata = (self.rodata_address, rodata)
+        self.data = bytearray(self.endAddress - self.dataAddress)
+
+        steps = 0
+        pc = labels.get("_start", 0)
+
+        while pc != self.EXIT_ADDRESS:
+            if pc % 4 != 0 or pc // 4 >= len(code):
+                raise SimulationError("fetch outside the program at 0x%x" % pc)
+            if steps >= self.max_steps:
+                raise SimulationError("no termination after %d instructions" % steps)
+
+            pc = code[pc // 4](pc)
+            steps += 1
+
+        return steps
+
+    # Two passes over the generator's assembly: lay out the sections like
+    # ext/boot.ld does, then resolve labels once the layout is known.
+    def __assemble(self, program):
+        text = []
+        data = []
+        labels = {}
+        section = text
+
+        for line in program.split("\n"):
+            line = line.split("#")[0].strip()
+
+            while ":" in line and not line.startswith("."):
+                label, line = line.split(":", 1)
+                labels[label.strip()] = (section is text, len(text) * 4 if section is text else len(data))
+                line = line.strip()
+
+            if line.endswith(":"):
+                labels[line[:-1]] = (section is text, len(text) * 4 if section is text else len(data))
+                continue
+
+            if not line:
+                continue
+
+            fields = line.split(None, 1)
+            operands = [op.strip() for op in fields[1].split(",")] if len(fields) > 1 else []
+
+            if fields[0] == ".section":
+                section = text if "text" in operands[0] else data
+            elif fields[0] == ".word":
+                data.append((4, operands[0]))
+            elif fields[0] == ".dword":
+                data.append((8, operands[0]))
+            elif fields[0] == ".balign":
+                data.append((-int(operands[0], 0), None))
+            elif fields[0].startswith("."):
+                continue
+            else:
+                text.append((fields[0], operands, line))
+
+        self.rodata_address = -(-len(text) * 4 // self.SECTION_ALIGNMENT) * self.SECTION_ALIGNMENT
+
+        # Data labels were recorded as item positions; turn them into addresses.
+        offsets = []
+        offset = 0
+        for size, value in data:
+            if size < 0:
+                offset = -(-offset // -size) * -size
+            offsets.append(offset)
+            if size > 0:
+                offset += size
+        offsets.append(offset)
+
+        resolved = {}
+        for label, (in_text, position) in labels.items():
+            resolved[label] = position if in_text else self.rodata_address + offsets[position]
+
+        rodata = bytearray(offset)
+        for (size, value), offset in zip(data, offsets):
+            if size > 0:
+                value = self.__value(value, resolved) & (2 ** (size * 8) - 1)
+                struct.pack_into(self._FORMATS[size], rodata, offset, value)
+
+        if self.rodata_address + len(rodata) > self.EXIT_ADDRESS:
+            raise SimulationError("program overlaps the exit address 0x%x" % self.EXIT_ADDRESS)
+
+        return text, bytes(rodata), resolved
+
+    def __value(self, operand, labels):
+        match = _RELOCATION.match(operand)
+        if match is not None:
+            value = self.__value(match.group(2), labels)
+            if match.group(1) == "hi":
+                return ((value + 0x800) >> 12) & 0xfffff
+            return _sext(value, 12)
+
+        if operand in labels:
+            return labels[operand]
+
+        try:
+            return int(operand, 0)
+        except ValueError:
+            raise SimulationError("undefined symbol %s" % operand)
+
+    def __int_register(self, name):
+        if name not in _INT_REGISTERS:
+            raise SimulationError("invalid integer register %s" % name)
+        return _INT_REGISTERS[name]
+
+    def __float_register(self, name):
+        if name not in _FLOAT_REGISTERS:
+            raise SimulationError("invalid float register %s" % name)
+        return _FLOAT_REGISTERS[name]
+
+    def __immediate(self, operand, labels, bits):
+        value = self.__value(operand, labels)
+        if value < -2 ** (bits - 1) or value >= 2 ** (bits - 1):
+            raise SimulationError("immediate %s out of range" % operand)
+        return value
+
+    def __decode(self, text, labels):
+        code = []
+
+        for mnemonic, operands, line in text:
+            try:
+                code.append(self.__decode_instruction(mnemonic, operands, labels))
+            except (IndexError, ValueError):
+                raise SimulationError("malformed instruction '%s'" % line)
+            except SimulationError as e:
+                raise SimulationError("%s in '%s'" % (e, line))
+
+        return code
+
+    def __decode_instruction(self, mnemonic, operands, labels):
+        if mnemonic == "nop":
+            return lambda pc: pc + 4
+
+        if mnemonic in ("lui", "auipc"):
+            rd = self.__int_register(operands[0])
+            imm = self.__value(operands[1], labels)
+            if imm < 0 or imm > 0xfffff:
+                raise SimulationError("immediate %s out of range" % operands[1])
+            value = _word(imm << 12)
+            if mnemonic == "lui":
+                return self.__write(rd, lambda pc: value)
+            return self.__write(rd, lambda pc: (pc + value) & _MASK64)
+
+        if mnemonic == "j":
+            target = self.__value(operands[0], labels)
+            return lambda pc: target
+
+        if mnemonic == "jal":
+            rd = self.__int_register(operands[0]) if len(operands) > 1 else 1
+            target = self.__value(operands[-1], labels)
+            def jal(pc):
+                self.__set(rd, pc + 4)
+                return target
+            return jal
+
+        if mnemonic == "jalr":
+            rd = self.__int_register(operands[0])
+            rs = self.__int_register(operands[1])
+            imm = self.__immediate(operands[2], labels, 12)
+            def jalr(pc):
+                target = (self.x[rs] + imm) & _MASK64 & ~1
+                self.__set(rd, pc + 4)
+                return target
+            return jalr
+
+        if mnemonic in self._BRANCHES:
+            rs1 = self.__int_register(operands[0])
+            rs2 = self.__int_register(operands[1])
+            target = self.__value(operands[2], labels)
+            test = self._BRANCHES[mnemonic]
+            return lambda pc: target if test(self.x[rs1], self.x[rs2]) else pc + 4
+
+        if mnemonic in self._LOADS or mnemonic in self._STORES:
+            return self.__decode_memory(mnemonic, operands, labels)
+
+        if mnemonic in self._ALU or mnemonic in self._DIVISIONS:
+            rd = self.__int_register(operands[0])
+            rs1 = self.__int_register(operands[1])
+            rs2 = self.__int_register(operands[2])
+            if mnemonic in self._ALU:
+                op = self._ALU[mnemonic]
+                return self.__write(rd, lambda pc: op(self.x[rs1], self.x[rs2]))
+
+            op = self._DIVISIONS[mnemonic]
+            divisor = (lambda v: v & _MASK32) if mnemonic.endswith("w") else (lambda v: v)
+            def division(pc):
+                if divisor(self.x[rs2]) == 0:
+                    raise SimulationError("division by zero at 0x%x" % pc)
+                return op(self.x[rs1], self.x[rs2])
+            return self.__write(rd, division)
+
+        if mnemonic in self._IMMEDIATES:
+            rd = self.__int_register(operands[0])
+            rs1 = self.__int_register(operands[1])
+            op = self._ALU[self._IMMEDIATES[mnemonic]]
+            if mnemonic[1:3] in ("ll", "rl", "ra"):
+                shamt = self.__value(operands[2], labels)
+                if shamt < 0 or shamt >= (32 if mnemonic.endswith("w") else 64):
+                    raise SimulationError("shift amount %s out of range" % operands[2])
+                imm = shamt
+            else:
+                imm = self.__immediate(operands[2], labels, 12) & _MASK64
+            return self.__write(rd, lambda pc: op(self.x[rs1], imm))
+
+        if mnemonic.startswith("f"):
+            return self.__decode_float(mnemonic, operands)
+
+        raise SimulationError("unsupported instruction %s" % mnemonic)
+
+    def __decode_memory(self, mnemonic, operands, labels):
+        match = _MEMORY_OPERAND.match(operands[1])
+        if match is None:
+            raise SimulationError("invalid memory operand %s" % operands[1])
+
+        offset = self.__immediate(match.group(1) or "0", labels, 12)
+        base = self.__int_register(match.group(2))
+
+        if mnemonic in self._LOADS:
+            size, signed = self._LOADS[mnemonic]
+            if signed is None:
+                rd = self.__float_register(operands[0])
+                box = (lambda v: v | _BOX32) if size == 4 else (lambda v: v)
+                def fload(pc):
+                    self.f[rd] = box(self.__load(pc, (self.x[base] + offset) & _MASK64, size))
+                    return pc + 4
+                return fload
+
+            rd = self.__int_register(operands[0])
+            if signed:
+                return self.__write(rd, lambda pc: _sext(self.__load(pc, (self.x[base] + offset) & _MASK64, size), size * 8) & _MASK64)
+            return self.__write(rd, lambda pc: self.__load(pc, (self.x[base] + offset) & _MASK64, size))
+
+        size = self._STORES[mnemonic]
+        if mnemonic.startswith("f"):
+            rs = self.__float_register(operands[0])
+            def fstore(pc):
+                self.__store(pc, (self.x[base] + offset) & _MASK64, size, self.f[rs])
+                return pc + 4
+            return fstore
+
+        rs = self.__int_register(operands[0])
+        def store(pc):
+            self.__store(pc, (self.x[base] + offset) & _MASK64, size, self.x[rs])
+            return pc + 4
+        return store
+
+    def __decode_float(self, mnemonic, operands):
+        fields = mnemonic.split(".")
+        op = fields[0]
+        single = fields[-1] == "s"
+        read = _bits_to_single if single else _bits_to_double
+        write = _single_to_bits if single else _double_to_bits
+
+        if op in ("fmv", "fcvt"):
+            return self.__decode_move(fields, operands)
+
+        if op in self._FLOAT_ARITHMETIC or op in ("fdiv", "fsgnj", "fsgnjn", "fsgnjx"):
+            rd = self.__float_register(operands[0])
+            rs1 = self.__float_register(operands[1])
+            rs2 = self.__float_register(operands[2])
+
+            if op.startswith("fsgnj"):
+                top = 31 if single else 63
+                mask = (1 << top) - 1
+                sign = {
+                    "fsgnj": lambda a, b: b >> top & 1,
+                    "fsgnjn": lambda a, b: (b >> top & 1) ^ 1,
+                    "fsgnjx": lambda a, b: (a >> top & 1) ^ (b >> top & 1),
+                }[op]
+                box = _BOX32 if single else 0
+                def fsgnj(pc):
+                    a, b = self.f[rs1], self.f[rs2]
+                    self.f[rd] = box | (a & mask) | (sign(a, b) << top)
+                    return pc + 4
+                return fsgnj
+
+            if op == "fdiv":
+                arithmetic = self.__float_division
+            else:
+                arithmetic = self._FLOAT_ARITHMETIC[op]
+
+            def farithmetic(pc):
+                self.f[rd] = write(arithmetic(read(self.f[rs1]), read(self.f[rs2])))
+                return pc + 4
+            return farithmetic
+
+        if op == "fsqrt":
+            rd = self.__float_register(operands[0])
+            rs1 = self.__float_register(operands[1])
+            def fsqrt(pc):
+                value = read(self.f[rs1])
+                self.f[rd] = write(math.sqrt(value) if value >= 0.0 else float('nan'))
+                return pc + 4
+            return fsqrt
+
+        if op in self._FLOAT_FUSED:
+            rd = self.__float_register(operands[0])
+            rs1, rs2, rs3 = [self.__float_register(r) for r in operands[1:4]]
+            fused = self._FLOAT_FUSED[op]
+            def ffused(pc):
+                self.f[rd] = write(fused(read(self.f[rs1]), read(self.f[rs2]), read(self.f[rs3])))
+                return pc + 4
+            return ffused
+
+        if op in self._FLOAT_COMPARE:
+            rd = self.__int_register(operands[0])
+            rs1 = self.__float_register(operands[1])
+            rs2 = self.__float_register(operands[2])
+            compare = self._FLOAT_COMPARE[op]
+            return self.__write(rd, lambda pc: compare(read(self.f[rs1]), read(self.f[rs2])))
+
+        if op == "fclass":
+            rd = self.__int_register(operands[0])
+            rs1 = self.__float_register(operands[1])
+            return self.__write(rd, lambda pc: _fclass(read(self.f[rs1]), self.f[rs1], single))
+
+        raise SimulationError("unsupported instruction %s" % mnemonic)
+
+    def __decode_move(self, fields, operands):
+        op, dst, src = fields[0], fields[1], fields[2]
+
+        if op == "fmv" and dst == "x":
+            rd = self.__int_register(operands[0])
+            rs1 = self.__float_register(operands[1])
+            if src == "d":
+                return self.__write(rd, lambda pc: self.f[rs1])
+            return self.__write(rd, lambda pc: _word(self.f[rs1]))
+
+        if op == "fmv":
+            rd = self.__float_register(operands[0])
+            rs1 = self.__int_register(operands[1])
+            box = (lambda v: v) if dst == "d" else (lambda v: _BOX32 | (v & _MASK32))
+            def fmv(pc):
+                self.f[rd] = box(self.x[rs1])
+                return pc + 4
+            return fmv
+
+        read = {"s": _bits_to_single, "d": _bits_to_double}
+        write = {"s": _single_to_bits, "d": _double_to_bits}
+        integers = {"w": (32, False), "wu": (32, True), "l": (64, False), "lu": (64, True)}
+
+        if dst in integers:
+            rd = self.__int_register(operands[0])
+            rs1 = self.__float_register(operands[1])
+            bits, unsigned = integers[dst]
+            convert = read[src]
+            extend = _word if bits == 32 else (lambda v: v & _MASK64)
+            return self.__write(rd, lambda pc: extend(_to_int(convert(self.f[rs1]), bits, unsigned)))
+
+        rd = self.__float_register(operands[0])
+        if src in integers:
+            rs1 = self.__int_register(operands[1])
+            bits, unsigned = integers[src]
+            value = (lambda v: v & _MASK32) if (bits, unsigned) == (32, True) else \
+                    (lambda v: _sext(v, 32)) if bits == 32 else \
+                    (lambda v: v) if unsigned else _signed
+            source = lambda pc: float(value(self.x[rs1]))
+        else:
+            rs1 = self.__float_register(operands[1])
+            convert = read[src]
+            source = lambda pc: convert(self.f[rs1])
+
+        result = write[dst]
+        def fcvt(pc):
+            self.f[rd] = result(source(pc))
+            return pc + 4
+        return fcvt
+
+    @staticmethod
+    def __float_division(a, b):
+        if b == 0.0:
+            if a == 0.0 or math.isnan(a):
+                return float('nan')
+            return math.copysign(float('inf'), a) * math.copysign(1.0, b)
+        return a / b
+
+    def __set(self, rd, value):
+        if rd != 0:
+            self.x[rd] = value & _MASK64
+
+    def __write(self, rd, compute):
+        def write(pc):
+            value = compute(pc)
+            if rd != 0:
+                self.x[rd] = value
+            return pc + 4
+        return write
+
+    def __region(self, pc, address, size, writable):
+        if address % size != 0:
+            raise SimulationError("misaligned %d byte access to 0x%x at 0x%x" % (size, address, pc))
+
+        if self.dataAddress <= address and address + size <= self.endAddress:
+            return self.data, address - self.dataAddress
+
+        base, rodata = self.rodata
+        if not writable and base <= address and address + size <= base + len(rodata):
+            return rodata, address - base
+
+        raise SimulationError("access to 0x%x outside the data window at 0x%x" % (address, pc))
+
+    def __load(self, pc, address, size):
+        memory, offset = self.__region(pc, address, size, False)
+        return struct.unpack_from(self._FORMATS[size], memory, offset)[0]
+
+    def __store(self, pc, address, size, value):
+        memory, offset = self.__region(pc, address, size, True)
+        struct.pack_into(self._FORMATS[size], memory, offset, value & (2 ** (size * 8) - 1))
@@ -0,0 +1,70 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+from src.sim_logs import parse_file_name, program_stem, read_cycles
+
+import heapq
+import os
+
+class ShardPlanner(object):
+    # lui/addi pair per register plus the loop counter setup
+    PROLOGUE_CYCLES = 64
+
+    def __init__(self, calibrator):
+        self.calibrator = calibrator
+        self.history = {}
+
+    def load_logs(self, dir, pools = None, counts = None):
+        self.calibrator.load_logs(dir, pools, counts)
+
+        for file in os.listdir(dir):
+            if not file.endswith(".log"):
+                continue
+
+            stem = program_stem(file)
+            if stem is None:
+                continue
+
+            with open(os.path.join(dir, file), "r") as f:
+                cycles = read_cycles(f.read())
+
+            if cycles is not None:
+                self.history[stem] = cycles
+
+    def get_cost(self, program):
+        stem = program_stem(program)
+        if stem in self.history:
+            return self.history[stem]
+
+        name = parse_file_name(os.path.basename(program))
+        if name is None or name.iterations is None:
+            return self.PROLOGUE_CYCLES
+
+        body = 0 if name.init else name.nInstructions * self.calibrator.get_cpi(name.instruction)
+        return self.PROLOGUE_CYCLES + name.iterations * (body + self.calibrator.LOOP_OVERHEAD)
+
+    # Longest processing time first: place the most expensive remaining
+    # program on the least loaded shard.
+    def plan(self, programs, nShards):
+        shards = [[] for i in range(0, nShards)]
+        loads = [(0, i) for i in range(0, nShards)]
+
+        costs = sorted(((self.get_cost(p), p) for p in programs), reverse=True)
+        for cost, program in costs:
+            load, shard = heapq.heappop(loads)
+            shards[shard].append(program)
+            heapq.heappush(loads, (load + cost, shard))
+
+        return shards, [load for load, shard in sorted(loads, key=lambda l: l[1])]
@@ -0,0 +1,66 @@
+# Copyright (C) 2020 Alisson Linhares, Rodolfo Azevedo.
+# All rights reserved.
+#
+# This project is a free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This file is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details:
+#
+# <http://www.gnu.org/licenses/>.
+
+import os
+import re
+
+EXPECTED_END_OF_SIMULATION = "Correct End of Simulation"
+
+# <index>_[not_taken_]<instruction>_<iterations>x<instructions>[_init]
+_SIZE_PATTERN = re.compile(r'_(\d+)x(\d+)(_init)?(?:\.|$)')
+_STEM_PATTERN = re.compile(r'^(.*?_\d+x\d+(?:_init)?)(?:\.|$)')
+
+class ProgramName(object):
+    def __init__(self, index, instruction, iterations, nInstructions, init):
+        self.index = index
+        self.instruction = instruction
+        self.iterations = iterations
+        self.nInstructions = nInstructions
+        self.init = init
+
+def parse_file_name(file):
+    sp_data = file.split("_")
+    if len(sp_data) < 2:
+        return None
+
+    index = sp_data[0]
+    if "not_taken" in file:
+        inst_name = sp_data[3] + "_not_taken"
+    else:
+        inst_name = sp_data[1]
+
+    iterations = None
+    nInstructions = None
+    match = _SIZE_PATTERN.search(file)
+    if match is not None:
+        iterations = int(match.group(1))
+        nInstructions = int(match.group(2))
+
+    return ProgramName(index, inst_name, iterations, nInstructions, "init" in file)
+
+# Name shared by a program and every file derived from it (binaries, logs,
+# reports), e.g. 0_fadd.d_32x64 for 0_fadd.d_32x64.riscv.log.
+def program_stem(file):
+    match = _STEM_PATTERN.match(os.path.basename(file))
+    if match is None:
+        return None
+    return match.group(1)
+
+def read_cycles(data):
+    if EXPECTED_END_OF_SIMULATION not in data:
+        return None
+
+    idx = data.rfind("CLK(") + 4
+    return int(data[idx:idx+8], 16)